@@ -3,8 +3,28 @@ import time
 import shutil
 import json
 import uuid
+import hashlib
+import sqlite3
+import threading
+import atexit
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import wraps
-from flask import Flask, render_template, jsonify, request, send_file, redirect, session, url_for
+from flask import Flask, Response, render_template, jsonify, request, send_file, redirect, session, url_for, g
+from file_index import FileIndex
+from archive import stream_zip
+from serving import serve_file
+from thumbs import ThumbnailCache, THUMB_SIZES
+from hls import HlsCache, MASTER, parse_variants
+from listing import DirListingCache, encode_cursor, resolve_cursor
+from dedup import DedupStore, HASH_BUFSIZE
+from lifecycle import ExpiryIndex, NEVER
+from sync import signature, apply_patch, default_block_size, file_version, PatchError, MIN_BLOCK, MAX_BLOCK
+import jobs
+from jobs import JobProgress, JobCancelled, tree_size, volume_of
+import metrics
+from metrics import timed_method
+from urllib.parse import quote
 
 app = Flask(__name__)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
@@ -15,13 +35,74 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.getenv('STORAGE_PATH', os.path.join(BASE_DIR, 'storage'))
 TRASH_DIR = os.getenv('TRASH_PATH', os.path.join(BASE_DIR, 'trash'))
 SHARE_DIR = os.getenv('SHARE_PATH', os.path.join(BASE_DIR, 'shares'))
+META_DIR = os.getenv('META_PATH', os.path.join(BASE_DIR, 'meta'))
 TRASH_META_FILE = os.path.join(TRASH_DIR, 'metadata.json')
 SHARE_META_FILE = os.path.join(SHARE_DIR, 'metadata.json')
+INDEX_DB_FILE = os.path.join(META_DIR, 'index.db')
+INDEX_RECONCILE_INTERVAL = int(os.getenv('INDEX_RECONCILE_INTERVAL', '600'))
+# 可选：为文本类文档建立内容索引 (/api/search?content=1)，每个文件只索引开头 SEARCH_CONTENT_MAX_KB
+SEARCH_CONTENT = os.getenv('SEARCH_CONTENT', '0') == '1'
+SEARCH_CONTENT_EXTENSIONS = ['.txt', '.md', '.csv', '.json']
+SEARCH_CONTENT_MAX_BYTES = int(os.getenv('SEARCH_CONTENT_MAX_KB', '256')) * 1024
+SEARCH_MAX_PAGE_SIZE = 200
+UPLOAD_META_FILE = os.path.join(META_DIR, 'uploads.json')
+PARTIAL_SUFFIX = '.part' # 分片上传中的临时文件: .<upload_id>.<name>.part
+UPLOAD_COPY_BUFSIZE = 1024 * 1024
+UPLOAD_SESSION_TTL = int(float(os.getenv('UPLOAD_SESSION_TTL_HOURS', '72')) * 3600) # 分片上传会话超过该时间没有新分片即清理 (含预分配的 .part 文件)，0 表示不清理
+UPLOAD_FINALIZE_TIMEOUT = 3600 # finalize 的占用标记超过该时间视为进程已退出，允许重新 finalize
+UPLOAD_CHECKSUM_ALGOS = ('md5', 'sha1', 'sha256', 'blake2b') # 只接受 hexdigest() 无需参数的算法 (shake_* 需要指定长度)
+ARCHIVE_REQUEST_FILE = os.path.join(META_DIR, 'archive_requests.json')
+ARCHIVE_REQUEST_TTL = 3600
+# 文件发送：图床链接的浏览器/CDN 缓存时长；可选交给前端代理发送文件体 ('' / 'x-accel' / 'x-sendfile')
+IMG_CACHE_MAX_AGE = int(os.getenv('IMG_CACHE_MAX_AGE', str(30 * 86400)))
+SENDFILE_OFFLOAD = os.getenv('SENDFILE_OFFLOAD', '').lower()
+SENDFILE_ACCEL_PREFIX = os.getenv('SENDFILE_ACCEL_PREFIX', '/_storage/')
+# 分享查询的进程内 LRU 缓存；其他 worker 创建/取消分享后，最多 SHARE_CACHE_CHECK_INTERVAL 秒内失效
+SHARE_CACHE_SIZE = int(os.getenv('SHARE_CACHE_SIZE', '4096'))
+SHARE_CACHE_CHECK_INTERVAL = float(os.getenv('SHARE_CACHE_CHECK_INTERVAL', '1'))
+SHARE_COUNTER_FLUSH_INTERVAL = float(os.getenv('SHARE_COUNTER_FLUSH_INTERVAL', '5'))
+THUMB_DIR = os.path.join(META_DIR, 'thumbs')
+THUMB_CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_MB', '1024')) * 1024 * 1024
+THUMB_WORKERS = int(os.getenv('THUMB_WORKERS', '2'))
+# 视频转 HLS (需要 ffmpeg/ffprobe)：缓存上限 (按最近播放淘汰)、转码档位 (高度:视频码率kbps)、分片时长
+HLS_DIR = os.path.join(META_DIR, 'hls')
+HLS_CACHE_MAX_BYTES = int(os.getenv('HLS_CACHE_MAX_MB', '20480')) * 1024 * 1024
+HLS_VARIANTS = parse_variants(os.getenv('HLS_VARIANTS', '1080:5000,720:2800,480:1400'))
+HLS_SEGMENT_SECONDS = int(os.getenv('HLS_SEGMENT_SECONDS', '6'))
+HLS_MAX_AGE = 86400 # 播放列表与分片按源文件版本区分，内容不会变化
+# 目录列表缓存 (按目录 mtime 失效) 与分页；磁盘用量最多每 DISK_USAGE_TTL 秒计算一次
+LISTING_CACHE_DIRS = int(os.getenv('LISTING_CACHE_DIRS', '256'))
+LISTING_CACHE_TTL = float(os.getenv('LISTING_CACHE_TTL', '60'))
+LISTING_MAX_LIMIT = 5000
+DISK_USAGE_TTL = 5
+# 可选：复制与重复上传共享数据 ('' 关闭 / 'reflink' 仅 FICLONE / 'auto' reflink 不可用时改用硬链接)
+DEDUP_MODE = os.getenv('DEDUP_MODE', '').lower()
+DEDUP_DB_FILE = os.path.join(META_DIR, 'dedup.db')
+# 后台文件任务 (移动/复制/删除/还原/清空回收站)：同一文件系统上最多同时运行 JOB_VOLUME_CONCURRENCY 个
+JOB_META_FILE = os.path.join(META_DIR, 'jobs.json')
+JOB_VOLUME_CONCURRENCY = int(os.getenv('JOB_VOLUME_CONCURRENCY', '2'))
+JOB_HEARTBEAT_TIMEOUT = 60 # 运行中的任务超过该时间没有上报进度，视为 worker 已退出，不再占用名额
+JOB_RETENTION = 7 * 86400
+TRASH_RECORD_BATCH = 100 # 删除任务每批先写入多少条回收站记录再移动文件
+# 生命周期：分享链接、打包结果、回收站条目的到期时间登记在 lifecycle.db (按到期时间索引)，由 Celery beat 定期清理
+# 有效期为 0 表示永不过期；磁盘使用率超过高水位时按先后顺序提前清理打包结果与回收站，直到低于低水位
+LIFECYCLE_DB_FILE = os.path.join(META_DIR, 'lifecycle.db')
+SHARE_DEFAULT_TTL = int(float(os.getenv('SHARE_TTL_DAYS', '0')) * 86400)
+ARCHIVE_TTL = int(float(os.getenv('ARCHIVE_TTL_HOURS', '24')) * 3600)
+TRASH_RETENTION = int(float(os.getenv('TRASH_RETENTION_DAYS', '0')) * 86400)
+STORAGE_HIGH_WATERMARK = float(os.getenv('STORAGE_HIGH_WATERMARK', '0')) # 百分比，0 (默认) 关闭按水位淘汰
+STORAGE_LOW_WATERMARK = float(os.getenv('STORAGE_LOW_WATERMARK', '90'))
+LIFECYCLE_BATCH = 500
+LIFECYCLE_RETRY = 3600 # 清理失败 (如权限不足) 的条目推迟多久重试
+# 文件夹配额 (按递归大小/文件数，用量来自文件索引的目录聚合)
+QUOTA_META_FILE = os.path.join(META_DIR, 'quotas.json')
+# /metrics：登录后可直接访问；Prometheus 抓取时使用 Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
 
 ADMIN_USER = os.getenv('ADMIN_USER', 'admin')
 ADMIN_PASS = os.getenv('ADMIN_PASS', 'admin123')
 
-for d in [ROOT_DIR, TRASH_DIR, SHARE_DIR]:
+for d in [ROOT_DIR, TRASH_DIR, SHARE_DIR, META_DIR]:
     if not os.path.exists(d): os.makedirs(d)
 
 CATEGORY_EXTENSIONS = {
@@ -43,81 +124,394 @@ def auth_required(f):
 
 # --- 数据管理 ---
 class JsonManager:
+    """
+    元数据存储：SQLite (WAL) 键值表，value 为 JSON
+    单条记录读写 O(1)，跨 gunicorn 进程原子；首次启动自动迁移旧的 metadata.json
+    """
     def __init__(self, filepath):
         self.filepath = filepath
-        self.load_metadata()
-    def load_metadata(self):
-        if os.path.exists(self.filepath):
+        self.db_path = os.path.splitext(filepath)[0] + '.db'
+        self._local = threading.local()
+        self._conn().execute('CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._migrate_json()
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid(): # fork 之后不能复用父进程的连接
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL'); conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+    @contextmanager
+    def _write(self):
+        conn = self._conn(); conn.execute('BEGIN IMMEDIATE')
+        try: yield conn
+        except: conn.execute('ROLLBACK'); raise
+        else: conn.execute('COMMIT')
+    def _migrate_json(self):
+        if not os.path.exists(self.filepath): return
+        with self._write() as conn:
+            if not os.path.exists(self.filepath): return # 其他 worker 已完成迁移
             try:
-                with open(self.filepath, 'r', encoding='utf-8') as f: self.data = json.load(f)
-            except: self.data = {}
-        else: self.data = {}
-    def save_metadata(self):
-        try:
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
-                f.flush()
-                os.fsync(f.fileno())
-        except: pass
+                with open(self.filepath, 'r', encoding='utf-8') as f: data = json.load(f)
+            except: data = {}
+            conn.executemany('INSERT OR IGNORE INTO records (key, value) VALUES (?, ?)', [(k, json.dumps(v, ensure_ascii=False)) for k, v in data.items()])
+            os.replace(self.filepath, self.filepath + '.migrated')
+    @timed_method('get')
+    def get(self, key):
+        row = self._conn().execute('SELECT value FROM records WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+    @timed_method('insert')
+    def insert(self, key, value):
+        """仅当 key 不存在时写入，返回是否成功"""
+        cur = self._conn().execute('INSERT OR IGNORE INTO records (key, value) VALUES (?, ?)', (key, json.dumps(value, ensure_ascii=False)))
+        return cur.rowcount == 1
+    @timed_method('delete')
+    def delete(self, key):
+        return self._conn().execute('DELETE FROM records WHERE key = ?', (key,)).rowcount == 1
+    @timed_method('insert_many')
+    def insert_many(self, records):
+        """批量写入，整批一个事务、一次落盘"""
+        if not records: return
+        with self._write() as conn:
+            conn.executemany('INSERT OR REPLACE INTO records (key, value) VALUES (?, ?)', [(k, json.dumps(v, ensure_ascii=False)) for k, v in records.items()])
+    @timed_method('delete_many')
+    def delete_many(self, keys):
+        if not keys: return
+        with self._write() as conn: conn.executemany('DELETE FROM records WHERE key = ?', [(k,) for k in keys])
+    @timed_method('get_many')
+    def get_many(self, keys):
+        res, keys = {}, list(keys)
+        for i in range(0, len(keys), 500): # SQLite 单条语句参数数量有限
+            chunk = keys[i:i + 500]
+            for k, v in self._conn().execute(f"SELECT key, value FROM records WHERE key IN ({','.join('?' * len(chunk))})", chunk): res[k] = json.loads(v)
+        return res
+    @timed_method('update')
+    def update(self, key, fn):
+        """读-改-写 在同一个写事务内完成，并发更新不会丢失"""
+        with self._write() as conn:
+            row = conn.execute('SELECT value FROM records WHERE key = ?', (key,)).fetchone()
+            if not row: return None
+            value = fn(json.loads(row[0]))
+            conn.execute('UPDATE records SET value = ? WHERE key = ?', (json.dumps(value, ensure_ascii=False), key))
+            return value
+    @timed_method('items')
+    def items(self):
+        return [(k, json.loads(v)) for k, v in self._conn().execute('SELECT key, value FROM records')]
+    @timed_method('keys')
+    def keys(self):
+        return [r[0] for r in self._conn().execute('SELECT key FROM records')]
 
 class TrashManager(JsonManager):
-    def add_item(self, filename, original_rel_path, is_dir):
-        self.load_metadata() # 写入前同步
+    def new_item(self, filename, original_rel_path, is_dir):
+        """生成回收站条目 (尚未写入)，批量删除时先移动文件再统一 add_items"""
         unique_name = f"{int(time.time())}_{uuid.uuid4().hex[:6]}_{filename}"
-        self.data[unique_name] = {
+        return unique_name, {
             'original_name': filename, 'original_path': original_rel_path, 'is_dir': is_dir,
             'deleted_at': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'size_str': self._get_size_str(original_rel_path) if not is_dir else '-'
+            'size_str': self._get_size_str(original_rel_path, is_dir)
         }
-        self.save_metadata()
+    def add_item(self, filename, original_rel_path, is_dir):
+        unique_name, info = self.new_item(filename, original_rel_path, is_dir)
+        self.insert(unique_name, info)
         return unique_name
+    def add_items(self, items):
+        self.insert_many(items)
     def remove_item(self, unique_name):
-        self.load_metadata() # 写入前同步
-        if unique_name in self.data: del self.data[unique_name]; self.save_metadata()
+        self.delete(unique_name)
+    def remove_items(self, unique_names):
+        self.delete_many(unique_names)
     def get_list(self):
-        self.load_metadata() # 【核心修改】每次读取前强制刷新，防止不同进程数据不一致
         res = []
-        for uid, info in self.data.items():
+        for uid, info in self.items():
             res.append({'id': uid, 'name': info['original_name'], 'path': info['original_path'], 'mtime': info['deleted_at'], 'size': info.get('size_str', '-'), 'is_dir': info['is_dir']})
         return sorted(res, key=lambda x: x['mtime'], reverse=True)
-    def _get_size_str(self, rel_path):
-        try: return human_readable_size(os.path.getsize(os.path.join(ROOT_DIR, rel_path)))
+    def _get_size_str(self, rel_path, is_dir=False):
+        # 文件夹大小取自索引的目录聚合，不必遍历
+        try: return human_readable_size(path_usage(rel_path)[0] if is_dir else os.path.getsize(os.path.join(ROOT_DIR, rel_path)))
         except: return '-'
 
 class ShareManager(JsonManager):
-    def create_share(self, rel_path):
-        self.load_metadata() # 写入前同步
-        share_id = uuid.uuid4().hex[:6]
-        while share_id in self.data: share_id = uuid.uuid4().hex[:6]
+    """
+    get_file_info 走进程内 LRU 缓存 (图床热点路径)，由 share_version 变更计数器失效：
+    本进程的创建/取消立即清空缓存，其他进程的变更在下一次计数器检查时生效
+    """
+    def __init__(self, filepath, cache_size=SHARE_CACHE_SIZE, check_interval=SHARE_CACHE_CHECK_INTERVAL):
+        super().__init__(filepath)
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS share_version (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO share_version (id, value) VALUES (0, 0);
+        ''')
+        self.cache_size, self.check_interval = cache_size, check_interval
+        self._cache, self._cache_lock = OrderedDict(), threading.Lock()
+        self._cache_version, self._cache_checked = None, 0
+    def _version(self):
+        return self._conn().execute('SELECT value FROM share_version WHERE id = 0').fetchone()[0]
+    def _changed(self, conn):
+        conn.execute('UPDATE share_version SET value = value + 1 WHERE id = 0')
+        with self._cache_lock: self._cache.clear(); self._cache_checked = 0
+    def _refresh_cache(self):
+        now = time.monotonic()
+        if now - self._cache_checked < self.check_interval: return self._cache_version
+        version = self._version()
+        with self._cache_lock:
+            if version != self._cache_version: self._cache.clear(); self._cache_version = version
+            self._cache_checked = now
+        return version
+    def create_share(self, rel_path, ttl=0):
+        """ttl: 有效期 (秒)，0 表示永久有效"""
         full_path = os.path.join(ROOT_DIR, rel_path)
-        self.data[share_id] = {
+        now = time.time(); expires_at = now + ttl if ttl else None
+        info = {
             'file_path': rel_path, 'file_name': os.path.basename(rel_path), 'is_dir': os.path.isdir(full_path),
-            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'downloads': 0
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'downloads': 0, 'expires_at': expires_at
         }
-        self.save_metadata()
+        value = json.dumps(info, ensure_ascii=False)
+        with self._write() as conn:
+            share_id = uuid.uuid4().hex[:6]
+            while conn.execute('INSERT OR IGNORE INTO records (key, value) VALUES (?, ?)', (share_id, value)).rowcount == 0: share_id = uuid.uuid4().hex[:6]
+            self._changed(conn)
+        expiry_index.set('share', share_id, expires_at or now + NEVER)
         return share_id
     def cancel_share(self, share_id):
-        self.load_metadata() # 写入前同步
-        if share_id in self.data: del self.data[share_id]; self.save_metadata(); return True
-        return False
+        with self._write() as conn:
+            deleted = conn.execute('DELETE FROM records WHERE key = ?', (share_id,)).rowcount == 1
+            if deleted: self._changed(conn)
+        expiry_index.remove('share', [share_id])
+        return deleted
     def get_list(self):
-        self.load_metadata() # 【核心修改】每次读取前强制刷新，防止浏览器看到旧数据
         res = []
-        for sid, info in self.data.items():
+        for sid, info in self.items():
             exists = os.path.exists(os.path.join(ROOT_DIR, info['file_path']))
-            res.append({'id': sid, 'name': info['file_name'], 'path': info['file_path'], 'mtime': info['created_at'], 'downloads': info.get('downloads', 0), 'status': 'normal' if exists else 'lost'})
+            expires_at = info.get('expires_at')
+            status = 'expired' if expires_at and expires_at <= time.time() else ('normal' if exists else 'lost')
+            res.append({'id': sid, 'name': info['file_name'], 'path': info['file_path'], 'mtime': info['created_at'], 'downloads': info.get('downloads', 0), 'traffic': human_readable_size(info.get('bytes_served', 0)), 'status': status,
+                        'expires_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(expires_at)) if expires_at else None})
         return sorted(res, key=lambda x: x['mtime'], reverse=True)
     def get_file_info(self, share_id):
-        self.load_metadata() # 读取前同步
-        return self.data.get(share_id)
-    def increment_download(self, share_id):
-        self.load_metadata()
-        if share_id in self.data:
-            self.data[share_id]['downloads'] = self.data[share_id].get('downloads', 0) + 1
-            self.save_metadata()
+        """已过期的分享立即失效 (不必等清理任务删除记录)"""
+        info = self._cached_info(share_id)
+        return None if info and info.get('expires_at') and info['expires_at'] <= time.time() else info
+    def _cached_info(self, share_id):
+        version = self._refresh_cache()
+        with self._cache_lock:
+            if share_id in self._cache:
+                self._cache.move_to_end(share_id); return self._cache[share_id]
+        info = self.get(share_id) # 不存在的 ID 也缓存 (None)，挡住盗链/扫描流量
+        with self._cache_lock:
+            if version == self._cache_version:
+                self._cache[share_id] = info
+                if len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+        return info
+    def add_counts(self, counts):
+        """counts: {share_id: (次数, 字节数)}，整批一个事务累加"""
+        with self._write() as conn:
+            for share_id, (hits, nbytes) in counts.items():
+                row = conn.execute('SELECT value FROM records WHERE key = ?', (share_id,)).fetchone()
+                if not row: continue
+                info = json.loads(row[0])
+                info['downloads'] = info.get('downloads', 0) + hits; info['bytes_served'] = info.get('bytes_served', 0) + nbytes
+                conn.execute('UPDATE records SET value = ? WHERE key = ?', (json.dumps(info, ensure_ascii=False), share_id))
+
+class ShareCounter:
+    """
+    分享访问计数：请求线程只在内存中累加，后台线程每 flush_interval 秒把聚合结果一次性写回分享库
+    (每个进程各自累加，写回时做加法，多 worker 不会互相覆盖；进程退出时再写一次)
+    """
+    def __init__(self, manager, flush_interval):
+        self.manager, self.flush_interval = manager, flush_interval
+        self._pending, self._lock, self._pid = {}, threading.Lock(), None
+    def record(self, share_id, response):
+        self.count(share_id, response.status_code, response.content_length or 0, response.headers.get('Content-Range', ''))
+    def count(self, share_id, status, nbytes, content_range=''):
+        # 只有从头开始的请求算一次访问 (视频拖动产生的后续 Range 请求只累计流量)；304 不计
+        metrics.SHARE_REQUESTS.labels(share_id, str(status)).inc()
+        if status not in (200, 206): return
+        metrics.SHARE_BYTES.labels(share_id).inc(nbytes)
+        hit = 1 if status == 200 or content_range.startswith('bytes 0-') else 0
+        with self._lock:
+            c = self._pending.setdefault(share_id, [0, 0])
+            c[0] += hit; c[1] += nbytes
+        if self._pid != os.getpid(): self._start_flusher()
+    def _start_flusher(self):
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._pid = os.getpid()
+        def loop():
+            while True:
+                time.sleep(self.flush_interval)
+                try: self.flush()
+                except Exception: pass
+        threading.Thread(target=loop, name='share-counter-flusher', daemon=True).start()
+    def flush(self):
+        with self._lock: pending, self._pending = self._pending, {}
+        if pending: self.manager.add_counts(pending)
+
+class UploadManager(JsonManager):
+    """分片上传会话：目标路径、总大小、已接收区间 (多个 worker 可并行写入不同分片)"""
+    def create_upload(self, rel_dir, name, size, checksum=None):
+        upload_id = uuid.uuid4().hex
+        partial = os.path.join(ROOT_DIR, rel_dir, f".{upload_id}.{name}{PARTIAL_SUFFIX}")
+        with open(partial, 'wb') as f: f.truncate(size) # 预分配 (稀疏文件)，任意偏移都可直接写入
+        now = time.time()
+        self.insert(upload_id, {'dir': rel_dir, 'name': name, 'size': size, 'checksum': checksum, 'received': [], 'created_at': now, 'updated_at': now})
+        expiry_index.set('upload', upload_id, now + (UPLOAD_SESSION_TTL or NEVER))
+        return upload_id
+    def partial_path(self, upload_id, info):
+        return os.path.join(ROOT_DIR, info['dir'], f".{upload_id}.{info['name']}{PARTIAL_SUFFIX}")
+    def mark_received(self, upload_id, start, end):
+        # 只更新会话的活动时间，不改到期索引：清理时再按 updated_at 判断是否仍在使用
+        return self.update(upload_id, lambda info: {**info, 'received': merge_ranges(info['received'], start, end), 'updated_at': time.time()})
+    def claim(self, upload_id):
+        """
+        finalize 前原子地占用会话，并发的 finalize 只有一个能继续：返回 ('ok', info) / ('busy', info) / ('missing', None)
+        占用超过 UPLOAD_FINALIZE_TIMEOUT 的视为进程已退出，可以重新占用
+        """
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute('SELECT value FROM records WHERE key = ?', (upload_id,)).fetchone()
+            if not row: return 'missing', None
+            info = json.loads(row[0])
+            if info.get('finalizing', 0) > now - UPLOAD_FINALIZE_TIMEOUT: return 'busy', info
+            info['finalizing'] = now
+            conn.execute('UPDATE records SET value = ? WHERE key = ?', (json.dumps(info, ensure_ascii=False), upload_id))
+            return 'ok', info
+    def release(self, upload_id):
+        self.update(upload_id, lambda info: {**info, 'finalizing': 0, 'updated_at': time.time()})
+    def remove(self, upload_id, info):
+        """放弃会话：删除 .part 文件与记录 (文件已不存在也算成功)"""
+        try: os.remove(self.partial_path(upload_id, info))
+        except FileNotFoundError: pass
+        self.delete(upload_id)
+        expiry_index.remove('upload', [upload_id])
+
+class ArchiveRequestManager(JsonManager):
+    """流式打包下载的短期令牌：POST 登记文件列表，GET 凭令牌下载 (原生下载也能用短链接)"""
+    def create_request(self, files):
+        now = time.time()
+        self.delete_many([k for k, v in self.items() if v['created_at'] < now - ARCHIVE_REQUEST_TTL])
+        token = uuid.uuid4().hex
+        self.insert(token, {'files': files, 'created_at': now})
+        return token
+    def get_request(self, token):
+        info = self.get(token)
+        return info if info and info['created_at'] >= time.time() - ARCHIVE_REQUEST_TTL else None
+
+class JobManager(JsonManager):
+    """
+    后台文件任务：参数、状态 (queued/running/success/partial/failed/cancelled)、进度、取消标记；任务 ID 同时也是 Celery task_id
+    partial 为部分条目失败，全部条目失败时为 failed (逐条原因见 results)
+    """
+    FINISHED = ('success', 'partial', 'failed', 'cancelled')
+    def create_job(self, kind, params, volumes):
+        now = time.time()
+        self.delete_many([k for k, v in self.items() if v['state'] in self.FINISHED and v['updated_at'] < now - JOB_RETENTION])
+        job_id = uuid.uuid4().hex
+        self.insert(job_id, {'kind': kind, 'params': params, 'volumes': volumes, 'state': 'queued', 'cancel': False,
+                             'created_at': now, 'updated_at': now, 'progress': {}, 'results': [], 'error': None})
+        return job_id
+    def acquire(self, job_id):
+        """在同一个写事务内检查各卷上运行中的任务数并占位，返回 'run' / 'wait' / 其他 (已取消或已在运行，不再执行)"""
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute('SELECT value FROM records WHERE key = ?', (job_id,)).fetchone()
+            if not row: return 'missing'
+            job = json.loads(row[0])
+            if job['state'] == 'queued' and job['cancel']: job['state'] = 'cancelled'
+            elif job['state'] == 'queued':
+                busy = {}
+                for (v,) in conn.execute("SELECT value FROM records WHERE json_extract(value, '$.state') = 'running'"):
+                    other = json.loads(v)
+                    if now - other['updated_at'] > JOB_HEARTBEAT_TIMEOUT: continue
+                    for vol in other['volumes']: busy[vol] = busy.get(vol, 0) + 1
+                if any(busy.get(vol, 0) >= JOB_VOLUME_CONCURRENCY for vol in job['volumes']): return 'wait'
+                job['state'] = 'running'
+            else: return job['state']
+            job['updated_at'] = now
+            conn.execute('UPDATE records SET value = ? WHERE key = ?', (json.dumps(job, ensure_ascii=False), job_id))
+            return 'run' if job['state'] == 'running' else job['state']
+    def report(self, job_id, progress):
+        """更新进度 (兼作心跳)，返回是否已请求取消"""
+        job = self.update(job_id, lambda job: {**job, 'progress': progress, 'updated_at': time.time()})
+        return bool(job and job['cancel'])
+    def finish(self, job_id, state, results, error=None):
+        self.update(job_id, lambda job: {**job, 'state': state, 'results': results, 'error': error, 'updated_at': time.time()})
+    def request_cancel(self, job_id):
+        def fn(job):
+            if job['state'] in self.FINISHED: return job
+            return {**job, 'cancel': True, 'state': 'cancelled' if job['state'] == 'queued' else job['state'], 'updated_at': time.time()}
+        return self.update(job_id, fn)
+    def view(self, job_id, job):
+        state, error = job['state'], job['error']
+        if state == 'running' and time.time() - job['updated_at'] > JOB_HEARTBEAT_TIMEOUT: state, error = 'failed', 'Worker lost'
+        return {'id': job_id, 'kind': job['kind'], 'state': state, 'cancel_requested': job['cancel'], 'created_at': job['created_at'],
+                **job['progress'], 'results': job['results'], 'error': error}
+
+def trash_expiry(deleted_ts):
+    return deleted_ts + (TRASH_RETENTION or NEVER)
+
+class QuotaExceeded(Exception):
+    pass
+
+class QuotaManager(JsonManager):
+    """文件夹配额：{'max_bytes': 字节数或 None, 'max_files': 文件数或 None}，对该文件夹下所有层级的内容生效"""
+    def set_quota(self, rel_path, max_bytes=None, max_files=None):
+        rel_path = FileIndex.norm(rel_path)
+        if max_bytes is None and max_files is None: self.delete(rel_path)
+        else: self.insert(rel_path, {'max_bytes': max_bytes, 'max_files': max_files})
+    def status(self, rel_paths=None):
+        quotas = dict(self.items()) if rel_paths is None else self.get_many([FileIndex.norm(p) for p in rel_paths])
+        usage = file_index.dir_stats(quotas)
+        return {p: {'path': p, **q, 'used_bytes': usage.get(p, (0, 0))[0], 'used_files': usage.get(p, (0, 0))[1]} for p, q in quotas.items()}
+    def enforce(self, dest_rel, nbytes, nfiles, src_rel=None):
+        """
+        向 dest_rel 目录写入 nbytes 字节 / nfiles 个文件前检查目标及其所有上级的配额，超出时抛出 QuotaExceeded
+        src_rel 为移动的来源：同时包含来源与目标的文件夹用量不变，跳过
+        """
+        dest = FileIndex.norm(dest_rel); parts = dest.split('/') if dest else []
+        chain = [''] + ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+        if src_rel is not None:
+            src = FileIndex.norm(src_rel)
+            chain = [p for p in chain if p and src != p and not src.startswith(p + '/')]
+        for p, q in self.status(chain).items():
+            if q['max_bytes'] is not None and q['used_bytes'] + nbytes > q['max_bytes']:
+                raise QuotaExceeded(f"Quota exceeded: /{p} ({human_readable_size(q['used_bytes'])} of {human_readable_size(q['max_bytes'])} used)")
+            if q['max_files'] is not None and q['used_files'] + nfiles > q['max_files']:
+                raise QuotaExceeded(f"Quota exceeded: /{p} ({q['used_files']} of {q['max_files']} files)")
+    def move_path(self, old_rel, new_rel):
+        old_rel, new_rel = FileIndex.norm(old_rel), FileIndex.norm(new_rel)
+        moved = {k: v for k, v in self.items() if k == old_rel or k.startswith(old_rel + '/')}
+        if not moved: return
+        self.delete_many(list(moved))
+        self.insert_many({new_rel + k[len(old_rel):]: v for k, v in moved.items()})
+    def remove_paths(self, rel_paths):
+        rel_paths = [FileIndex.norm(p) for p in rel_paths]
+        self.delete_many([k for k in self.keys() if any(k == p or k.startswith(p + '/') for p in rel_paths)])
+
+def merge_ranges(ranges, start, end):
+    """把 [start, end) 并入已排序且不重叠的区间列表"""
+    res = []
+    for s, e in ranges:
+        if e < start or s > end: res.append([s, e])
+        else: start, end = min(s, start), max(e, end)
+    res.append([start, end])
+    return sorted(res)
 
 trash_manager = TrashManager(TRASH_META_FILE)
 share_manager = ShareManager(SHARE_META_FILE)
+upload_manager = UploadManager(UPLOAD_META_FILE)
+archive_request_manager = ArchiveRequestManager(ARCHIVE_REQUEST_FILE)
+job_manager = JobManager(JOB_META_FILE)
+expiry_index = ExpiryIndex(LIFECYCLE_DB_FILE)
+quota_manager = QuotaManager(QUOTA_META_FILE)
+share_counter = ShareCounter(share_manager, SHARE_COUNTER_FLUSH_INTERVAL)
+thumb_cache = ThumbnailCache(THUMB_DIR, THUMB_CACHE_MAX_BYTES, THUMB_WORKERS)
+hls_cache = HlsCache(HLS_DIR, HLS_CACHE_MAX_BYTES, HLS_VARIANTS, HLS_SEGMENT_SECONDS, os.getenv('FFMPEG_BIN', 'ffmpeg'), os.getenv('FFPROBE_BIN', 'ffprobe'))
+listing_cache = DirListingCache(LISTING_CACHE_DIRS, LISTING_CACHE_TTL, ignore_suffixes=(PARTIAL_SUFFIX,))
+atexit.register(share_counter.flush)
+file_index = FileIndex(INDEX_DB_FILE, ROOT_DIR, CATEGORY_EXTENSIONS, ignore_suffixes=(PARTIAL_SUFFIX,), content_index=SEARCH_CONTENT)
+file_index.start_reconciler(INDEX_RECONCILE_INTERVAL)
+if SEARCH_CONTENT: file_index.start_content_indexer(SEARCH_CONTENT_EXTENSIONS, SEARCH_CONTENT_MAX_BYTES)
+dedup_store = DedupStore(DEDUP_DB_FILE, ROOT_DIR, DEDUP_MODE, tmp_suffix=PARTIAL_SUFFIX) if DEDUP_MODE in ('reflink', 'auto') else None
 
 def human_readable_size(size):
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -125,23 +519,312 @@ def human_readable_size(size):
         size /= 1024
     return f"{size:.2f} PB"
 
+def path_usage(rel_path):
+    """(字节数, 文件数)：文件夹直接读目录聚合，索引尚未建好时才遍历"""
+    abs_path = os.path.join(ROOT_DIR, rel_path)
+    if not os.path.isdir(abs_path): return os.path.getsize(abs_path), 1
+    if file_index.ready: return file_index.dir_stat(rel_path)
+    files, size = tree_size(abs_path)
+    return size, files
+
+_disk_usage_cache = {'at': 0, 'value': None}
 def get_disk_usage():
+    now = time.monotonic()
+    if _disk_usage_cache['value'] and now - _disk_usage_cache['at'] < DISK_USAGE_TTL: return _disk_usage_cache['value']
     try:
         total, used, free = shutil.disk_usage(ROOT_DIR)
-        return {'used': human_readable_size(used), 'total': human_readable_size(total), 'percent': (used / total) * 100}
+        stored, files = file_index.dir_stat('')
+        value = {'used': human_readable_size(used), 'total': human_readable_size(total), 'percent': (used / total) * 100,
+                 'stored': human_readable_size(stored), 'file_count': files}
     except: return {'used': '0 B', 'total': '0 B', 'percent': 0}
+    _disk_usage_cache.update(at=now, value=value)
+    return value
 
-def clean_old_archives():
-    now = time.time()
-    for f in os.listdir(ROOT_DIR):
-        if f.startswith('batch_download_') and f.endswith('.zip'):
-            path = os.path.join(ROOT_DIR, f)
-            try:
-                if os.stat(path).st_mtime < now - 3600: os.remove(path)
-            except: pass
+def storage_offload(rel_path):
+    if SENDFILE_OFFLOAD == 'x-accel': return ('X-Accel-Redirect', SENDFILE_ACCEL_PREFIX + quote(rel_path.replace('\\', '/')))
+    if SENDFILE_OFFLOAD == 'x-sendfile': return ('X-Sendfile', os.path.join(ROOT_DIR, rel_path))
+    return None
+
+def send_storage_file(rel_path, **kwargs):
+    return serve_file(os.path.join(ROOT_DIR, rel_path), offload=storage_offload(rel_path), **kwargs)
+
+def share_hls_url(share_id, info):
+    """分享的视频已转好 HLS 时返回 master 播放列表地址 (访客只能使用，不能触发转码)"""
+    if info['is_dir'] or os.path.splitext(info['file_name'])[1].lower() not in CATEGORY_EXTENSIONS['video']: return None
+    try: state, _ = hls_cache.status(os.path.join(ROOT_DIR, info['file_path']), FileIndex.norm(info['file_path']))
+    except OSError: return None
+    return f"/s/{quote(share_id)}/hls/{MASTER}" if state == 'ready' else None
+
+def share_hls_file(info, name):
+    """分享视频的 HLS 播放列表/分片路径；未转码或名称不合法时返回 None"""
+    try: state, out_dir = hls_cache.status(os.path.join(ROOT_DIR, info['file_path']), FileIndex.norm(info['file_path']))
+    except OSError: return None
+    return hls_cache.file_path(os.path.basename(out_dir), name) if state == 'ready' else None
+
+# --- 生命周期清理 (Celery beat 定期执行 tasks.lifecycle_task) ---
+# 到期时间都登记在 expiry_index，清理只按索引取已到期的条目，不遍历存储目录
+
+def register_archive(abs_path):
+    """
+    登记打包结果的到期时间 (由 tasks.compress_files_task 调用)：开始写入前先登记一次，作为该文件由本程序生成的标记
+    (进程中途退出时残留的文件也会被清理；未登记的同名文件视为用户文件，不会被删除)，写完后再调用一次更新到期时间并写入文件索引
+    """
+    rel = FileIndex.norm(os.path.relpath(abs_path, ROOT_DIR))
+    expiry_index.set('archive', rel, time.time() + (ARCHIVE_TTL or NEVER))
+    file_index.upsert_path(rel)
+
+def unregister_archive(abs_path):
+    """打包失败 (文件已删除) 时撤销登记"""
+    expiry_index.remove('archive', [FileIndex.norm(os.path.relpath(abs_path, ROOT_DIR))])
+
+def _sync_trash_expiry():
+    # 回收站条目的到期时间 = 删除时间 + 保留期限：首次运行 (升级前的条目没有登记) 以及 TRASH_RETENTION_DAYS 修改后，
+    # 按当前的保留期限重新登记全部条目，新的期限对已在回收站中的条目同样生效
+    if expiry_index.flag('trash_backfill') and expiry_index.flag('trash_retention') == TRASH_RETENTION: return
+    items = {}
+    for uid, info in trash_manager.items():
+        try: deleted = time.mktime(time.strptime(info['deleted_at'], '%Y-%m-%d %H:%M:%S'))
+        except (KeyError, ValueError): deleted = time.time()
+        items[uid] = trash_expiry(deleted)
+    expiry_index.set_many('trash', items)
+    expiry_index.set_flag('trash_backfill'); expiry_index.set_flag('trash_retention', TRASH_RETENTION)
+
+def _backfill_uploads():
+    # 升级前创建的分片上传会话按创建时间补登 (清理时仍会按最后活动时间顺延)
+    if expiry_index.flag('upload_backfill'): return
+    expiry_index.set_many('upload', {uid: info['created_at'] + (UPLOAD_SESSION_TTL or NEVER) for uid, info in upload_manager.items()}, replace=False)
+    expiry_index.set_flag('upload_backfill')
+
+def _expire(kind, key):
+    """删除单个到期条目，返回释放的字节数 (顺延时返回 None)；文件已不存在也算成功。删除失败时抛出异常，索引条目保留 (由调用方推迟重试)"""
+    freed = 0
+    if kind == 'share': share_manager.cancel_share(key)
+    elif kind == 'archive':
+        path = os.path.join(ROOT_DIR, key)
+        if os.path.isfile(path): freed = os.path.getsize(path); os.remove(path)
+        file_index.remove_path(key)
+    elif kind == 'trash':
+        path = os.path.join(TRASH_DIR, key)
+        if os.path.lexists(path): freed = tree_size(path)[1]; jobs.remove_tree(path)
+        trash_manager.remove_item(key)
+    elif kind == 'upload':
+        # 分片上传会话：最后一次收到分片后 UPLOAD_SESSION_TTL 内仍在使用的，顺延到期时间
+        info = upload_manager.get(key)
+        if info and info.get('updated_at', info['created_at']) + UPLOAD_SESSION_TTL > time.time():
+            expiry_index.set('upload', key, info.get('updated_at', info['created_at']) + UPLOAD_SESSION_TTL); return None
+        state, info = upload_manager.claim(key) if info else ('missing', None)
+        if state == 'busy': expiry_index.set('upload', key, time.time() + UPLOAD_FINALIZE_TIMEOUT); return None
+        if state == 'ok':
+            try: freed = os.stat(upload_manager.partial_path(key, info)).st_blocks * 512 # 预分配的稀疏文件按实际占用计算
+            except OSError: pass
+            upload_manager.remove(key, info)
+    expiry_index.remove(kind, [key])
+    return freed
+
+def _expire_failed(counts, kind, key, e):
+    counts['errors'] += 1
+    expiry_index.set(kind, key, time.time() + LIFECYCLE_RETRY)
+    app.logger.warning(f"Lifecycle expire {kind}/{key} failed: {e}")
+
+def _disk_percent():
+    total, used, free = shutil.disk_usage(ROOT_DIR)
+    return used * 100 / total
+
+def _relieve_pressure(counts):
+    # 使用率超过高水位时，按到期先后淘汰打包结果，仍不够再淘汰回收站 (回收站与存储在同一文件系统时才有效)
+    # 只淘汰设置了保留期限的条目：永久保留 (到期时间为 NEVER) 的回收站条目与打包结果不会因磁盘写满被删除
+    if not STORAGE_HIGH_WATERMARK or _disk_percent() < STORAGE_HIGH_WATERMARK: return
+    kinds = ['archive'] + (['trash'] if volume_of(TRASH_DIR) == volume_of(ROOT_DIR) else [])
+    for kind in kinds:
+        failed = set() # 本轮删除失败的条目不再重试，全部失败时停止
+        while _disk_percent() > STORAGE_LOW_WATERMARK:
+            keys = [k for k in expiry_index.earliest(kind, 20 + len(failed), before=time.time() + NEVER / 2) if k not in failed]
+            if not keys: break
+            for key in keys:
+                try: freed = _expire(kind, key)
+                except Exception as e: failed.add(key); _expire_failed(counts, kind, key, e); continue
+                counts['freed'] += freed; counts['evicted'] += 1
+                app.logger.warning(f"Storage above {STORAGE_HIGH_WATERMARK}%: evicted {kind}/{key} before expiry ({freed} bytes)")
+
+def run_lifecycle(interval=0):
+    """清理到期的分享、打包结果与回收站条目，再按水位淘汰；interval 秒内重复触发时直接返回 None"""
+    if not expiry_index.claim('sweep', interval): return None
+    _sync_trash_expiry(); _backfill_uploads()
+    counts = {'share': 0, 'archive': 0, 'trash': 0, 'upload': 0, 'evicted': 0, 'freed': 0, 'errors': 0}
+    while True:
+        batch = expiry_index.due(time.time(), LIFECYCLE_BATCH)
+        for kind, key in batch:
+            try: freed = _expire(kind, key)
+            except Exception as e: _expire_failed(counts, kind, key, e); continue # 推迟到 LIFECYCLE_RETRY 之后，不会在本轮反复取到
+            if freed is not None: counts['freed'] += freed; counts[kind] += 1
+        if len(batch) < LIFECYCLE_BATCH: break
+    _relieve_pressure(counts)
+    return counts
+
+# --- 后台文件任务 (在 Celery worker 中执行，见 tasks.file_job_task) ---
+# 每个处理函数返回逐条结果；取消后剩余条目标记为 cancelled，已完成的部分照常写入元数据
+
+def _job_copy_file(src, dst, progress):
+    if not dedup_store: return jobs.copy_file(src, dst, progress, PARTIAL_SUFFIX)
+    method = dedup_store.copy_file(os.path.relpath(src, ROOT_DIR), os.path.relpath(dst, ROOT_DIR), fallback=lambda a, b: jobs.copy_file(a, b, progress, PARTIAL_SUFFIX))
+    if method != 'copy': progress.advance(os.path.getsize(dst), os.path.basename(src)) # reflink/硬链接瞬间完成，一次计入进度
+
+def _plan(progress, pairs):
+    # 只有跨文件系统 (或复制) 的条目需要实际搬运数据，计入总字节数
+    progress.items_total = len(pairs)
+    progress.bytes_total = sum(tree_size(src, progress)[1] for src, dst, copy in pairs if copy and os.path.lexists(src))
+    progress.flush()
+
+def _run_items(progress, items, fn, key='path'):
+    results = []
+    for i, item in enumerate(items):
+        try:
+            res = fn(item); results.append({key: item, 'status': 'success', **(res or {})})
+        except JobCancelled:
+            results += [{key: x, 'status': 'cancelled'} for x in items[i:]]; break
+        except Exception as e: results.append({key: item, 'status': 'error', 'error': str(e)})
+        try: progress.item_done()
+        except JobCancelled:
+            results += [{key: x, 'status': 'cancelled'} for x in items[i + 1:]]; break
+    return results
+
+def job_operate(params, progress):
+    action, files = params['action'], params['files']; dest_abs = os.path.join(ROOT_DIR, params['dest'])
+    dest_vol = volume_of(dest_abs)
+    pairs = [(os.path.join(ROOT_DIR, p), os.path.join(dest_abs, os.path.basename(p)), action == 'copy' or volume_of(os.path.join(ROOT_DIR, p)) != dest_vol) for p in files]
+    _plan(progress, pairs)
+    def run(rel_path):
+        src = os.path.join(ROOT_DIR, rel_path); dst = os.path.join(dest_abs, os.path.basename(rel_path)); dst_rel = os.path.relpath(dst, ROOT_DIR)
+        quota_manager.enforce(params['dest'], *path_usage(rel_path), src_rel=rel_path if action == 'move' else None)
+        if action == 'move':
+            jobs.move_path(src, dst, progress, _job_copy_file); file_index.move_path(rel_path, dst_rel)
+            quota_manager.move_path(rel_path, dst_rel)
+            if dedup_store: dedup_store.move_path(rel_path, dst_rel)
+        elif action == 'copy':
+            jobs.copy_tree(src, dst, progress, _job_copy_file, (PARTIAL_SUFFIX,)); file_index.upsert_path(dst_rel)
+        else: raise ValueError('Unknown action')
+    return _run_items(progress, files, run)
+
+def job_delete(params, progress):
+    # 移入回收站；回收站与存储不在同一文件系统时带进度复制
+    # 每 TRASH_RECORD_BATCH 条先批量写入回收站记录再移动：进程中途退出时已移入的文件仍在回收站列表中 (不会丢失)；
+    # 未移动成功的条目在结束时撤销记录 (进程退出时残留的空记录，彻底删除时视为成功)
+    files, reserved, unused, removed, pos = params['files'], {}, [], [], [0]
+    trash_vol = volume_of(TRASH_DIR)
+    _plan(progress, [(os.path.join(ROOT_DIR, p), None, volume_of(os.path.join(ROOT_DIR, p)) != trash_vol) for p in files])
+    def is_archive(src):
+        return expiry_index.contains('archive', FileIndex.norm(os.path.relpath(src, ROOT_DIR)))
+    def reserve(indices):
+        items = {}
+        for i in indices:
+            src = os.path.join(ROOT_DIR, files[i])
+            if not os.path.lexists(src) or is_archive(src): continue
+            reserved[i], info = trash_manager.new_item(os.path.basename(files[i]), files[i], os.path.isdir(src))
+            items[reserved[i]] = info
+        trash_manager.add_items(items)
+        expiry_index.set_many('trash', {uid: trash_expiry(time.time()) for uid in items})
+    def run(p):
+        i = pos[0]; pos[0] += 1
+        if i % TRASH_RECORD_BATCH == 0: reserve(range(i, min(i + TRASH_RECORD_BATCH, len(files))))
+        src = os.path.join(ROOT_DIR, p)
+        if not os.path.lexists(src): raise FileNotFoundError('Not found')
+        if is_archive(src):
+            # 打包结果 (下载完成后前端会请求删除) 直接删除，不进回收站
+            os.remove(src); expiry_index.remove('archive', [FileIndex.norm(os.path.relpath(src, ROOT_DIR))]); removed.append(p); return {'status': 'removed'}
+        if i not in reserved: reserve([i]) # 写入本批记录之后才出现的文件
+        uid = reserved.pop(i)
+        try: jobs.move_path(src, os.path.join(TRASH_DIR, uid), progress)
+        except BaseException:
+            if not os.path.lexists(os.path.join(TRASH_DIR, uid)): unused.append(uid)
+            raise
+        removed.append(p)
+        return {'id': uid}
+    try: return _run_items(progress, files, run)
+    finally:
+        unused += reserved.values() # 取消后未处理的条目
+        trash_manager.remove_items(unused)
+        expiry_index.remove('trash', unused)
+        file_index.remove_paths(removed)
+        quota_manager.remove_paths(removed)
+        if dedup_store: dedup_store.remove_paths(removed)
+
+def job_restore(params, progress):
+    uids, restored = params['items'], []
+    infos = trash_manager.get_many(uids)
+    def target(uid):
+        info = infos[uid]; tgt = os.path.join(ROOT_DIR, info['original_path'])
+        return tgt if os.path.exists(os.path.dirname(tgt)) else os.path.join(ROOT_DIR, info['original_name'])
+    root_vol = volume_of(ROOT_DIR)
+    _plan(progress, [(os.path.join(TRASH_DIR, uid), None, uid in infos and volume_of(os.path.join(TRASH_DIR, uid)) != root_vol) for uid in uids])
+    def run(uid):
+        if uid not in infos: raise KeyError('Not found')
+        tgt = target(uid)
+        files, size = tree_size(os.path.join(TRASH_DIR, uid), progress)
+        quota_manager.enforce(os.path.relpath(os.path.dirname(tgt), ROOT_DIR), size, files)
+        jobs.move_path(os.path.join(TRASH_DIR, uid), tgt, progress)
+        restored.append(uid); file_index.upsert_path(os.path.relpath(tgt, ROOT_DIR))
+        return {'path': os.path.relpath(tgt, ROOT_DIR).replace('\\', '/')}
+    try: return _run_items(progress, uids, run, key='id')
+    finally:
+        trash_manager.remove_items(restored)
+        expiry_index.remove('trash', restored)
+
+def job_purge(params, progress):
+    # 永久删除回收站条目 (items 为空表示清空回收站)；进度按条目数计算 (不预先统计大小，删除期间逐个文件发送心跳)，文件已不存在也视为成功
+    uids, purged = trash_manager.keys() if params['items'] is None else params['items'], []
+    progress.items_total = len(uids); progress.flush()
+    def run(uid):
+        p = os.path.join(TRASH_DIR, uid)
+        if os.path.lexists(p): jobs.remove_tree(p, progress)
+        purged.append(uid)
+    try: return _run_items(progress, uids, run, key='id')
+    finally:
+        trash_manager.remove_items(purged)
+        expiry_index.remove('trash', purged)
+
+JOB_HANDLERS = {'operate': job_operate, 'delete': job_delete, 'restore': job_restore, 'purge': job_purge}
+
+def execute_job(job_id):
+    job = job_manager.get(job_id)
+    progress = JobProgress(lambda state: job_manager.report(job_id, state))
+    try:
+        results = JOB_HANDLERS[job['kind']](job['params'], progress)
+        progress.flush()
+        errors = sum(r['status'] == 'error' for r in results)
+        if progress.cancelled: job_manager.finish(job_id, 'cancelled', results)
+        elif not errors: job_manager.finish(job_id, 'success', results)
+        else: job_manager.finish(job_id, 'failed' if errors == len(results) else 'partial', results, f'{errors} of {len(results)} items failed')
+    except JobCancelled: job_manager.finish(job_id, 'cancelled', []) # 统计大小阶段被取消，尚未处理任何条目
+    except Exception as e:
+        job_manager.finish(job_id, 'failed', [], str(e))
+
+def submit_job(kind, params, paths):
+    job_id = job_manager.create_job(kind, params, sorted({volume_of(p) for p in paths}))
+    from tasks import file_job_task
+    file_job_task.apply_async((job_id,), task_id=job_id)
+    return jsonify({'status': 'success', 'job_id': job_id}), 202
 
 # ================= 路由 =================
 
+@app.before_request
+def start_timer(): g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    # 按路由模板统计 (/img/<share_id> 而非具体 URL)，避免标签无限增长
+    if 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.labels(request.method, endpoint, str(response.status_code)).observe(time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    authorized = session.get('logged_in') or (METRICS_TOKEN and request.headers.get('Authorization') == f'Bearer {METRICS_TOKEN}')
+    if not authorized: return jsonify({'error': 'Unauthorized'}), 401
+    if not metrics.ENABLED: return jsonify({'error': 'prometheus_client not installed'}), 404
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.route('/login', methods=['GET'])
 def login_page():
     if session.get('logged_in'): return redirect('/')
@@ -174,16 +857,23 @@ def public_share_link(share_id):
     if info['is_dir']: return f"这是一个文件夹 ({info['file_name']})，暂不支持下载。", 200
 
     if request.args.get('dl') == '1':
-        share_manager.increment_download(share_id)
-        response = send_file(abs_path, as_attachment=False, download_name=info['file_name'])
-        response.headers["Accept-Ranges"] = "bytes"
+        response = send_storage_file(info['file_path'], download_name=info['file_name'], cache_control='public, no-cache')
+        share_counter.record(share_id, response)
         return response
     
     download_url = url_for('public_share_link', share_id=share_id, dl='1')
-    return render_template('share.html', filename=info['file_name'], download_url=download_url)
+    return render_template('share.html', filename=info['file_name'], download_url=download_url, hls_url=share_hls_url(share_id, info))
+
+@app.route('/s/<share_id>/hls/<path:name>')
+def public_share_hls(share_id, name):
+    info = share_manager.get_file_info(share_id)
+    path = share_hls_file(info, name) if info else None
+    if not path: return "404 Not Found", 404
+    try: return serve_file(path, download_name=os.path.basename(name), cache_control=f'public, max-age={HLS_MAX_AGE}')
+    except FileNotFoundError: return "404 Not Found", 404
 
 
-# --- 图床专用接口 (无缓存限制) ---
+# --- 图床专用接口 (分享 ID 不变，允许浏览器/CDN 长期缓存) ---
 @app.route('/img/<share_id>')
 @app.route('/img/<share_id>.<ext>') 
 def image_hosting(share_id, ext=None):
@@ -191,18 +881,13 @@ def image_hosting(share_id, ext=None):
     info = share_manager.get_file_info(share_id)
     if not info: return "404 Not Found", 404
     
-    abs_path = os.path.join(ROOT_DIR, info['file_path'])
-    if not os.path.exists(abs_path): return "404 Not Found", 404
-    
-    # 2. 增加下载计数 (可选，如果你想统计图床流量)
-    # share_manager.increment_download(share_id)
+    # 2. 直接在浏览器显示/播放；支持范围请求 (视频拖动进度条)、ETag/304，sendfile 零拷贝
+    # 不再单独 os.path.exists，文件是否存在由 serve_file 内的 stat 判断
+    try: response = send_storage_file(info['file_path'], cache_control=f'public, max-age={IMG_CACHE_MAX_AGE}, immutable')
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError): return "404 Not Found", 404
 
-    # 3. 直接返回文件流 (as_attachment=False 表示在浏览器直接显示/播放)
-    response = send_file(abs_path, as_attachment=False)
-    
-    # 4. 开启范围请求支持 (这对视频流播放和拖动进度条至关重要)
-    response.headers["Accept-Ranges"] = "bytes"
-    
+    # 3. 访问计数 + 流量统计 (内存累加，后台批量写回，不拖慢响应)
+    share_counter.record(share_id, response)
     return response
     
 # --- 受保护的 API ---
@@ -210,34 +895,77 @@ def image_hosting(share_id, ext=None):
 @app.route('/api/list')
 @auth_required
 def list_files():
+    # 参数: path, sort=name|mtime|size, order=asc|desc, q=文件名包含, type=dir|file|分类, limit, cursor
+    # 不传 limit 时返回全部 (兼容旧前端)
     req_path = request.args.get('path', '')
     if '..' in req_path: return jsonify({'error': 'Invalid path'}), 400
     abs_path = os.path.join(ROOT_DIR, req_path)
-    if not os.path.exists(abs_path): return jsonify({'files': [], 'usage': get_disk_usage()})
+    try: hit = listing_cache.get(abs_path)
+    except OSError: return jsonify({'files': [], 'total': 0, 'next_cursor': None, 'usage': get_disk_usage()})
+    sort = request.args.get('sort', 'name'); order = request.args.get('order', 'asc')
+    entries = listing_cache.sorted_entries(hit, sort, order)
+    indexed = file_index.ready
+    if sort == 'size' and indexed:
+        # 文件夹按递归大小排序 (目录聚合会随写操作变化，不进入列表缓存)
+        dirs = [e for e in entries if e[1]]
+        sizes = file_index.dir_stats([os.path.join(req_path, e[0]) for e in dirs])
+        dirs.sort(key=lambda e: sizes.get(FileIndex.norm(os.path.join(req_path, e[0])), (0, 0))[0], reverse=order == 'desc')
+        entries = dirs + [e for e in entries if not e[1]]
+
+    q = request.args.get('q', '').lower(); ftype = request.args.get('type', '')
+    if q: entries = [e for e in entries if q in e[0].lower()]
+    if ftype == 'dir': entries = [e for e in entries if e[1]]
+    elif ftype == 'file': entries = [e for e in entries if not e[1]]
+    elif ftype in CATEGORY_EXTENSIONS:
+        exts = set(CATEGORY_EXTENSIONS[ftype]); entries = [e for e in entries if not e[1] and os.path.splitext(e[0])[1].lower() in exts]
+
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1: return jsonify({'error': 'Invalid limit'}), 400
+    start = resolve_cursor(request.args.get('cursor'), hit['version'], [e[0] for e in entries]) if request.args.get('cursor') else 0
+    page = entries[start:start + min(limit, LISTING_MAX_LIMIT)] if limit else entries[start:]
+    next_cursor = encode_cursor(hit['version'], start + len(page), page[-1][0]) if limit and page and start + len(page) < len(entries) else None
+
     files = []
-    try:
-        with os.scandir(abs_path) as entries:
-            for entry in entries:
-                stat = entry.stat()
-                files.append({'name': entry.name, 'is_dir': entry.is_dir(), 'size': human_readable_size(stat.st_size) if not entry.is_dir() else '-', 'mtime': time.strftime('%Y-%m-%d %H:%M', time.localtime(stat.st_mtime)), 'path': os.path.join(req_path, entry.name).replace('\\', '/')})
-    except: pass
-    return jsonify({'files': sorted(files, key=lambda x: (not x['is_dir'], x['name'])), 'usage': get_disk_usage()})
+    dir_stats = file_index.dir_stats([os.path.join(req_path, e[0]) for e in page if e[1]]) if indexed else {}
+    for name, is_dir, size, mtime in page:
+        rel = os.path.join(req_path, name).replace('\\', '/')
+        item = {'name': name, 'is_dir': is_dir, 'size': human_readable_size(size) if not is_dir else '-', 'mtime': time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime)), 'path': rel, 'thumb': None if is_dir else thumb_url(rel)}
+        if is_dir and indexed:
+            dir_size, dir_files = dir_stats.get(FileIndex.norm(rel), (0, 0))
+            item.update(size=human_readable_size(dir_size), file_count=dir_files)
+        files.append(item)
+    quota = quota_manager.status([req_path]).get(FileIndex.norm(req_path))
+    return jsonify({'files': files, 'total': len(entries), 'next_cursor': next_cursor, 'usage': get_disk_usage(), 'quota': quota})
 
 @app.route('/api/category')
 @auth_required
 def list_by_category():
     category_type = request.args.get('type')
-    valid_exts = set(CATEGORY_EXTENSIONS.get(category_type, []))
-    files = []
-    for root, dirs, filenames in os.walk(ROOT_DIR):
-        for name in filenames:
-            if os.path.splitext(name)[1].lower() in valid_exts:
-                abs_path = os.path.join(root, name)
-                try:
-                    stat = os.stat(abs_path)
-                    files.append({'name': name, 'is_dir': False, 'size': human_readable_size(stat.st_size), 'mtime': time.strftime('%Y-%m-%d %H:%M', time.localtime(stat.st_mtime)), 'path': os.path.relpath(abs_path, ROOT_DIR).replace('\\', '/')})
-                except: pass
-    return jsonify({'files': sorted(files, key=lambda x: x['mtime'], reverse=True), 'usage': get_disk_usage()})
+    sort = request.args.get('sort', 'mtime'); order = request.args.get('order', 'desc')
+    page = max(request.args.get('page', 1, type=int), 1); page_size = request.args.get('page_size', type=int)
+    # 分类视图直接查询索引；不传 page_size 时返回全部 (兼容旧前端)
+    limit = page_size if page_size and page_size > 0 else None
+    rows, total = file_index.query_category(category_type, sort, order, (page - 1) * (limit or 0), limit)
+    files = [{'name': r['name'], 'is_dir': False, 'size': human_readable_size(r['size']), 'mtime': time.strftime('%Y-%m-%d %H:%M', time.localtime(r['mtime'])), 'path': r['path'], 'thumb': thumb_url(r['path'])} for r in rows]
+    return jsonify({'files': files, 'total': total, 'page': page, 'page_size': limit, 'indexing': not file_index.ready, 'usage': get_disk_usage()})
+
+@app.route('/api/search')
+@auth_required
+def search_files():
+    # 参数: q, mode=auto|prefix|fuzzy, type=分类, content=1 (搜索文本内容), page, page_size
+    q = request.args.get('q', '').strip()
+    if not q: return jsonify({'error': 'Empty query'}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = min(max(request.args.get('page_size', 50, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    offset = (page - 1) * page_size
+    if request.args.get('content') == '1':
+        if not SEARCH_CONTENT: return jsonify({'error': 'Content search disabled'}), 400
+        if len(q) < 3: return jsonify({'error': 'Query too short'}), 400
+        rows, has_more = file_index.search_content(q, offset, page_size)
+    else:
+        rows, has_more = file_index.search(q, request.args.get('mode', 'auto'), request.args.get('type') or None, offset, page_size)
+    files = [{'name': r['name'], 'is_dir': False, 'size': human_readable_size(r['size']), 'mtime': time.strftime('%Y-%m-%d %H:%M', time.localtime(r['mtime'])), 'path': r['path'], **({'snippet': r['snippet']} if 'snippet' in r else {})} for r in rows]
+    return jsonify({'files': files, 'page': page, 'page_size': page_size, 'has_more': has_more, 'indexing': not file_index.ready})
 
 @app.route('/api/mkdir', methods=['POST'])
 @auth_required
@@ -251,37 +979,40 @@ def create_folder():
 @auth_required
 def rename_item():
     try:
-        os.rename(os.path.join(ROOT_DIR, request.json.get('path')), os.path.join(ROOT_DIR, os.path.dirname(request.json.get('path')), request.json.get('name')))
+        old_rel = request.json.get('path'); new_rel = os.path.join(os.path.dirname(old_rel), request.json.get('name'))
+        os.rename(os.path.join(ROOT_DIR, old_rel), os.path.join(ROOT_DIR, new_rel))
+        file_index.move_path(old_rel, new_rel)
+        quota_manager.move_path(old_rel, new_rel)
+        if dedup_store: dedup_store.move_path(old_rel, new_rel)
         return jsonify({'status': 'success'})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 @app.route('/api/operate', methods=['POST'])
 @auth_required
 def operate_items():
-    data = request.json; action = data.get('action'); dest_abs = os.path.join(ROOT_DIR, data.get('dest', ''))
+    # 移动/复制可能涉及大量数据，作为后台任务执行，进度见 /api/jobs/<job_id>
+    data = request.json; action = data.get('action'); dest = data.get('dest', ''); files = data.get('files', [])
+    dest_abs = os.path.join(ROOT_DIR, dest)
     if not os.path.exists(dest_abs): return jsonify({'error': 'Dest not found'}), 404
-    success, errors = 0, []
-    for rel_path in data.get('files', []):
-        try:
-            src = os.path.join(ROOT_DIR, rel_path); dst = os.path.join(dest_abs, os.path.basename(rel_path))
-            if action == 'move': shutil.move(src, dst)
-            elif action == 'copy': shutil.copytree(src, dst) if os.path.isdir(src) else shutil.copy2(src, dst)
-            success += 1
-        except Exception as e: errors.append(str(e))
-    return jsonify({'success': success, 'errors': errors})
+    if action not in ('move', 'copy'): return jsonify({'error': 'Invalid action'}), 400
+    return submit_job('operate', {'action': action, 'files': files, 'dest': dest}, [dest_abs] + [os.path.join(ROOT_DIR, p) for p in files])
 
 @app.route('/api/share/create', methods=['POST'])
 @auth_required
 def create_share_link():
     files = request.json.get('files', [])
     links = []
+    # 有效期 (秒)：未提供时使用 SHARE_TTL_DAYS，0 表示永久有效
+    try: ttl = int(request.json.get('expires_in', SHARE_DEFAULT_TTL))
+    except (TypeError, ValueError): return jsonify({'error': 'Invalid expires_in'}), 400
+    if ttl < 0: return jsonify({'error': 'Invalid expires_in'}), 400
     
     # 获取图片和视频的后缀列表
     media_exts = set(CATEGORY_EXTENSIONS['image'] + CATEGORY_EXTENSIONS['video'])
 
     for p in files:
         if os.path.exists(os.path.join(ROOT_DIR, p)):
-            share_id = share_manager.create_share(p)
+            share_id = share_manager.create_share(p, ttl)
             filename = os.path.basename(p)
             ext = os.path.splitext(filename)[1].lower()
             
@@ -308,18 +1039,8 @@ def cancel_share_link(): share_manager.cancel_share(request.json.get('id')); ret
 @app.route('/api/delete', methods=['POST'])
 @auth_required
 def soft_delete():
-    count = 0
-    for p in request.json.get('files', []):
-        src = os.path.join(ROOT_DIR, p)
-        if os.path.exists(src):
-            if os.path.basename(p).startswith('batch_download_') and p.endswith('.zip'):
-                try: os.remove(src)
-                except: pass
-                continue
-            uid = trash_manager.add_item(os.path.basename(p), p, os.path.isdir(src))
-            try: shutil.move(src, os.path.join(TRASH_DIR, uid)); count+=1
-            except: pass
-    return jsonify({'status': 'success', 'count': count})
+    files = request.json.get('files', [])
+    return submit_job('delete', {'files': files}, [TRASH_DIR] + [os.path.join(ROOT_DIR, p) for p in files])
 
 @app.route('/api/trash/list')
 @auth_required
@@ -328,33 +1049,16 @@ def get_trash_list(): return jsonify(trash_manager.get_list())
 @app.route('/api/trash/restore', methods=['POST'])
 @auth_required
 def restore_trash():
-    count = 0
-    for uid in request.json.get('items', []):
-        info = trash_manager.data.get(uid)
-        if info:
-            tgt = os.path.join(ROOT_DIR, info['original_path'])
-            if not os.path.exists(os.path.dirname(tgt)): tgt = os.path.join(ROOT_DIR, info['original_name'])
-            try: shutil.move(os.path.join(TRASH_DIR, uid), tgt); trash_manager.remove_item(uid); count+=1
-            except: pass
-    return jsonify({'status': 'success', 'count': count})
+    items = request.json.get('items', [])
+    return submit_job('restore', {'items': items}, [ROOT_DIR] + [os.path.join(TRASH_DIR, uid) for uid in items])
 
 @app.route('/api/trash/delete', methods=['POST'])
 @auth_required
-def permanent_delete():
-    for uid in request.json.get('items', []):
-        p = os.path.join(TRASH_DIR, uid)
-        try: (shutil.rmtree(p) if os.path.isdir(p) else os.remove(p)); trash_manager.remove_item(uid)
-        except: pass
-    return jsonify({'status': 'success'})
+def permanent_delete(): return submit_job('purge', {'items': request.json.get('items', [])}, [TRASH_DIR])
 
 @app.route('/api/trash/empty', methods=['POST'])
 @auth_required
-def empty_trash():
-    for uid in list(trash_manager.data.keys()):
-        p = os.path.join(TRASH_DIR, uid)
-        try: (shutil.rmtree(p) if os.path.isdir(p) else os.remove(p)); trash_manager.remove_item(uid)
-        except: pass
-    return jsonify({'status': 'success'})
+def empty_trash(): return submit_job('purge', {'items': None}, [TRASH_DIR])
 
 @app.route('/api/upload', methods=['POST'])
 @auth_required
@@ -362,13 +1066,257 @@ def upload_file():
     if 'file' not in request.files: return jsonify({'error': 'No file'}), 400
     file = request.files['file']; save_dir = os.path.join(ROOT_DIR, request.form.get('path', ''))
     if not os.path.exists(save_dir): os.makedirs(save_dir)
-    file.save(os.path.join(save_dir, file.filename))
+    rel_path = os.path.join(request.form.get('path', ''), file.filename); deduplicated = False
+    # 请求体大小 (含 multipart 包装，略偏大) 作为文件大小的上限；覆盖同名文件时扣除旧文件
+    old = os.path.join(save_dir, file.filename); old_size = os.path.getsize(old) if os.path.isfile(old) else None
+    try: quota_manager.enforce(request.form.get('path', ''), (request.content_length or 0) - (old_size or 0), 0 if old_size is not None else 1)
+    except QuotaExceeded as e: return jsonify({'error': str(e)}), 413
+    if dedup_store:
+        # 先写临时文件并顺带计算 sha256，再原子替换：覆盖硬链接文件时不会改到共享数据的另一份
+        tmp = os.path.join(save_dir, f".{uuid.uuid4().hex}.{file.filename}{PARTIAL_SUFFIX}"); h = hashlib.sha256()
+        try:
+            with open(tmp, 'wb') as f:
+                for buf in iter(lambda: file.stream.read(HASH_BUFSIZE), b''): h.update(buf); f.write(buf)
+            deduplicated = dedup_store.commit_upload(tmp, rel_path, h.hexdigest())
+        except BaseException: # 写入中断或落盘失败时删除临时文件 (已替换/已丢弃时不存在)
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+    else: file.save(os.path.join(save_dir, file.filename))
+    listing_cache.invalidate(save_dir) # 覆盖同名文件不会改变目录 mtime
+    file_index.upsert_path(rel_path)
+    return jsonify({'status': 'success', 'deduplicated': deduplicated})
+
+# --- 分片/断点续传上传 ---
+# init -> PUT 分片 (可并行、可重传) -> GET 查询已接收区间 -> finalize (可选校验)
+
+@app.route('/api/upload/init', methods=['POST'])
+@auth_required
+def upload_init():
+    data = request.json; rel_dir = data.get('path', ''); name = data.get('name', ''); size = data.get('size')
+    if '..' in rel_dir or not name or name != os.path.basename(name) or name in ('.', '..'): return jsonify({'error': 'Invalid path'}), 400
+    if not isinstance(size, int) or size < 0: return jsonify({'error': 'Invalid size'}), 400
+    checksum = data.get('checksum') # 形如 "sha256:<hex>"
+    if checksum and checksum.split(':', 1)[0] not in UPLOAD_CHECKSUM_ALGOS: return jsonify({'error': 'Unsupported checksum'}), 400
+    save_dir = os.path.join(ROOT_DIR, rel_dir)
+    old = os.path.join(save_dir, name); old_size = os.path.getsize(old) if os.path.isfile(old) else None
+    try: quota_manager.enforce(rel_dir, size - (old_size or 0), 0 if old_size is not None else 1)
+    except QuotaExceeded as e: return jsonify({'error': str(e)}), 413
+    if not os.path.exists(save_dir): os.makedirs(save_dir)
+    upload_id = upload_manager.create_upload(rel_dir, name, size, checksum)
+    return jsonify({'status': 'success', 'upload_id': upload_id, 'chunk_size': UPLOAD_COPY_BUFSIZE * 8})
+
+@app.route('/api/upload/<upload_id>', methods=['GET'])
+@auth_required
+def upload_status(upload_id):
+    info = upload_manager.get(upload_id)
+    if not info: return jsonify({'error': 'Upload not found'}), 404
+    received = sum(e - s for s, e in info['received'])
+    return jsonify({'upload_id': upload_id, 'name': info['name'], 'path': info['dir'], 'size': info['size'], 'received': received, 'ranges': info['received'], 'complete': received == info['size']})
+
+@app.route('/api/upload/<upload_id>', methods=['PUT'])
+@auth_required
+def upload_chunk(upload_id):
+    info = upload_manager.get(upload_id)
+    if not info: return jsonify({'error': 'Upload not found'}), 404
+    if info.get('finalizing', 0) > time.time() - UPLOAD_FINALIZE_TIMEOUT: return jsonify({'error': 'Upload is being finalized'}), 409
+    offset = request.args.get('offset', type=int); length = request.content_length
+    if offset is None or offset < 0 or length is None or offset + length > info['size']: return jsonify({'error': 'Invalid range'}), 400
+    # 直接从 WSGI 输入流写入 .part 文件的对应偏移，不经过 werkzeug 的临时文件
+    # .part 文件或会话记录在此期间被清理 (会话过期) 时返回 410，客户端应重新 init
+    written = 0
+    try:
+        with open(upload_manager.partial_path(upload_id, info), 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                buf = request.stream.read(min(UPLOAD_COPY_BUFSIZE, length - written))
+                if not buf: break
+                f.write(buf); written += len(buf)
+    except FileNotFoundError: return jsonify({'error': 'Upload session expired'}), 410
+    if written:
+        info = upload_manager.mark_received(upload_id, offset, offset + written)
+        if not info: return jsonify({'error': 'Upload session expired'}), 410
+    if written < length: return jsonify({'error': 'Incomplete chunk', 'received': written}), 400
+    return jsonify({'status': 'success', 'ranges': info['received']})
+
+@app.route('/api/upload/<upload_id>/finalize', methods=['POST'])
+@auth_required
+def upload_finalize(upload_id):
+    # 先占用会话：重复/并发的 finalize 返回 409，而不是在 os.replace 上相互竞争
+    state, info = upload_manager.claim(upload_id)
+    if state == 'missing': return jsonify({'error': 'Upload not found'}), 404
+    if state == 'busy': return jsonify({'error': 'Upload is being finalized'}), 409
+    try:
+        if info['size'] and info['received'] != [[0, info['size']]]:
+            upload_manager.release(upload_id); return jsonify({'error': 'Upload incomplete', 'ranges': info['received']}), 409
+        partial = upload_manager.partial_path(upload_id, info); digest = None
+        if info.get('checksum'):
+            algo, expected = info['checksum'].split(':', 1)
+            h = hashlib.new(algo)
+            with open(partial, 'rb') as f:
+                for buf in iter(lambda: f.read(UPLOAD_COPY_BUFSIZE), b''): h.update(buf)
+            if h.hexdigest() != expected.lower():
+                upload_manager.release(upload_id); return jsonify({'error': 'Checksum mismatch', 'actual': f"{algo}:{h.hexdigest()}"}), 422
+            if algo == 'sha256': digest = h.hexdigest() # 去重时可直接复用，不必再读一遍
+        rel_path = os.path.join(info['dir'], info['name'])
+        if dedup_store: deduplicated = dedup_store.commit_upload(partial, rel_path, digest)
+        else: os.replace(partial, os.path.join(ROOT_DIR, rel_path)); deduplicated = False
+    except FileNotFoundError:
+        # .part 文件已被清理 (会话过期或目标目录被删除)，会话无法完成
+        upload_manager.remove(upload_id, info); return jsonify({'error': 'Upload not found'}), 404
+    except BaseException:
+        upload_manager.release(upload_id); raise
+    upload_manager.delete(upload_id)
+    expiry_index.remove('upload', [upload_id])
+    file_index.upsert_path(rel_path)
+    return jsonify({'status': 'success', 'path': rel_path.replace('\\', '/'), 'deduplicated': deduplicated})
+
+@app.route('/api/upload/<upload_id>', methods=['DELETE'])
+@auth_required
+def upload_abort(upload_id):
+    state, info = upload_manager.claim(upload_id)
+    if state == 'missing': return jsonify({'error': 'Upload not found'}), 404
+    if state == 'busy': return jsonify({'error': 'Upload is being finalized'}), 409
+    upload_manager.remove(upload_id, info)
     return jsonify({'status': 'success'})
 
+# --- 增量同步 (rsync 算法，见 sync.py) ---
+# GET 签名 -> 客户端只发送变化的部分 -> POST 补丁，服务器合成新文件后原子替换
+
+def _sync_target(rel_path):
+    if not rel_path or '..' in rel_path.split('/'): return None
+    path = os.path.join(ROOT_DIR, rel_path)
+    return path if os.path.isfile(path) else None
+
+@app.route('/api/sync/signature')
+@auth_required
+def sync_signature():
+    rel_path = request.args.get('path', ''); path = _sync_target(rel_path)
+    if not path: return jsonify({'error': 'File not found'}), 404
+    block_size = request.args.get('block_size', type=int) or default_block_size(os.path.getsize(path))
+    if not MIN_BLOCK <= block_size <= MAX_BLOCK: return jsonify({'error': 'Invalid block_size'}), 400
+    with metrics.scan_timer('sync_signature'): sig = signature(path, block_size)
+    return jsonify({'path': rel_path, **sig})
+
+@app.route('/api/sync/patch', methods=['POST'])
+@auth_required
+def sync_patch():
+    # 参数：path、base (签名中的 version)、block_size、size (新文件大小)、checksum (sha256:<hex>)；请求体为补丁
+    args = request.args; rel_path = args.get('path', ''); path = _sync_target(rel_path)
+    if not path: return jsonify({'error': 'File not found'}), 404
+    block_size, size, checksum = args.get('block_size', type=int), args.get('size', type=int), args.get('checksum', '')
+    if not block_size or not MIN_BLOCK <= block_size <= MAX_BLOCK or size is None or size < 0: return jsonify({'error': 'Invalid parameters'}), 400
+    if not checksum.startswith('sha256:'): return jsonify({'error': 'checksum (sha256) required'}), 400
+    base = file_version(os.stat(path))
+    if args.get('base') != base: return jsonify({'error': 'File changed since signature', 'version': base}), 409
+    try: quota_manager.enforce(os.path.dirname(rel_path), size - os.path.getsize(path), 0)
+    except QuotaExceeded as e: return jsonify({'error': str(e)}), 413
+    tmp = os.path.join(os.path.dirname(path), f".{uuid.uuid4().hex}.{os.path.basename(path)}{PARTIAL_SUFFIX}")
+    try:
+        digest = apply_patch(path, tmp, request.stream, block_size, size)
+        if digest != checksum.split(':', 1)[1].lower(): return jsonify({'error': 'Checksum mismatch', 'actual': f"sha256:{digest}"}), 422
+        shutil.copymode(path, tmp)
+        # 合成期间文件被其他请求覆盖时放弃，不覆盖对方的修改
+        if file_version(os.stat(path)) != base: return jsonify({'error': 'File changed during patch'}), 409
+        if dedup_store: dedup_store.commit_upload(tmp, rel_path, digest)
+        else: os.replace(tmp, path)
+    except PatchError as e: return jsonify({'error': str(e)}), 400
+    finally:
+        try: os.remove(tmp)
+        except OSError: pass
+    listing_cache.invalidate(os.path.dirname(path)) # 覆盖文件不会改变目录 mtime
+    file_index.upsert_path(rel_path)
+    return jsonify({'status': 'success', 'path': rel_path, 'size': size, 'version': file_version(os.stat(path))})
+
+@app.route('/api/quota', methods=['GET'])
+@auth_required
+def list_quotas():
+    return jsonify({'quotas': sorted(quota_manager.status().values(), key=lambda q: q['path']), 'indexing': not file_index.ready})
+
+@app.route('/api/quota', methods=['POST'])
+@auth_required
+def set_quota():
+    # max_bytes / max_files 均为 null 表示取消配额
+    data = request.json; rel_path = data.get('path', '')
+    if '..' in rel_path or not os.path.isdir(os.path.join(ROOT_DIR, rel_path)): return jsonify({'error': 'Invalid path'}), 400
+    limits = [data.get('max_bytes'), data.get('max_files')]
+    if any(v is not None and (not isinstance(v, int) or v < 0) for v in limits): return jsonify({'error': 'Invalid limit'}), 400
+    quota_manager.set_quota(rel_path, *limits)
+    return jsonify({'status': 'success', 'quota': quota_manager.status([rel_path]).get(FileIndex.norm(rel_path))})
+
+@app.route('/api/lifecycle', methods=['GET'])
+@auth_required
+def lifecycle_status():
+    return jsonify({'expiry': expiry_index.stats(time.time()), 'disk_percent': _disk_percent(),
+                    'config': {'share_ttl': SHARE_DEFAULT_TTL, 'archive_ttl': ARCHIVE_TTL, 'trash_retention': TRASH_RETENTION, 'upload_ttl': UPLOAD_SESSION_TTL,
+                               'high_watermark': STORAGE_HIGH_WATERMARK, 'low_watermark': STORAGE_LOW_WATERMARK}})
+
+@app.route('/api/lifecycle/run', methods=['POST'])
+@auth_required
+def lifecycle_run():
+    # 立即执行一次清理 (不等 beat 的下一个周期)
+    from tasks import lifecycle_task
+    task = lifecycle_task.delay(0)
+    return jsonify({'status': 'success', 'task_id': task.id}), 202
+
+@app.route('/api/hls')
+@auth_required
+def hls_status():
+    # 查询视频的 HLS 版本，尚未生成时提交转码任务 (start=0 只查询)；pending 时返回进度，前端轮询直到 ready
+    rel_path = FileIndex.norm(request.args.get('path', ''))
+    if '..' in rel_path or os.path.splitext(rel_path)[1].lower() not in CATEGORY_EXTENSIONS['video']: return jsonify({'error': 'Invalid path'}), 400
+    if not hls_cache.available: return jsonify({'error': 'ffmpeg not installed'}), 404
+    abs_path = os.path.join(ROOT_DIR, rel_path)
+    try:
+        state, detail = hls_cache.status(abs_path, rel_path)
+        if state == 'missing' and request.args.get('start', '1') == '1':
+            task_id = uuid.uuid4().hex
+            if hls_cache.claim(abs_path, rel_path, task_id):
+                from tasks import hls_task
+                hls_task.apply_async((rel_path,), task_id=task_id)
+            state, detail = hls_cache.status(abs_path, rel_path)
+    except FileNotFoundError: return jsonify({'error': 'Not found'}), 404
+    if state == 'ready': return jsonify({'state': 'ready', 'playlist': url_for('hls_file', key=os.path.basename(detail), name=MASTER)})
+    if state == 'pending': return jsonify({'state': 'pending', 'task_id': detail.get('task_id'), 'percent': detail.get('percent', 0), 'variant': detail.get('variant')}), 202
+    if state == 'failed': return jsonify({'state': 'failed', 'error': detail['error']})
+    return jsonify({'state': 'missing'})
+
+@app.route('/api/hls/<key>/<path:name>')
+@auth_required
+def hls_file(key, name):
+    path = hls_cache.file_path(key, name)
+    if not path: return jsonify({'error': 'Invalid path'}), 400
+    try: return serve_file(path, download_name=os.path.basename(name), cache_control=f'private, max-age={HLS_MAX_AGE}')
+    except FileNotFoundError: return jsonify({'error': 'Not found'}), 404
+
+@app.route('/api/dedup/report')
+@auth_required
+def dedup_report():
+    if not dedup_store: return jsonify({'enabled': False})
+    report = dedup_store.report()
+    return jsonify({'enabled': True, 'mode': DEDUP_MODE, **report, 'saved': human_readable_size(report['saved_bytes'])})
+
+@app.route('/api/archive/stream', methods=['POST'])
+@auth_required
+def create_stream_archive():
+    files = request.json.get('files', [])
+    if not files or any('..' in p for p in files): return jsonify({'error': 'Invalid path'}), 400
+    token = archive_request_manager.create_request(files)
+    return jsonify({'status': 'success', 'url': url_for('stream_archive', token=token)})
+
+@app.route('/api/archive/stream/<token>')
+@auth_required
+def stream_archive(token):
+    # 边打包边输出：已压缩的媒体直接存储，文本等才 deflate，不生成临时文件也不经过 Celery
+    info = archive_request_manager.get_request(token)
+    if not info: return jsonify({'error': 'Archive link expired'}), 404
+    abs_paths = [os.path.join(ROOT_DIR, p) for p in info['files']]
+    filename = f"archive_{int(time.time())}.zip"
+    return Response(stream_zip(abs_paths), mimetype='application/zip', headers={'Content-Disposition': f'attachment; filename="{filename}"', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/archive', methods=['POST'])
 @auth_required
 def archive_files():
-    clean_old_archives()
     from tasks import compress_files_task
     abs_paths = [os.path.join(ROOT_DIR, p) for p in request.json.get('files')]
     task = compress_files_task.delay(abs_paths)
@@ -385,16 +1333,66 @@ def task_status(task_id):
     elif task.state == 'FAILURE': res['error'] = str(task.result)
     return jsonify(res)
 
+@app.route('/api/jobs')
+@auth_required
+def list_jobs():
+    jobs_list = sorted(job_manager.items(), key=lambda kv: kv[1]['created_at'], reverse=True)[:request.args.get('limit', 50, type=int)]
+    return jsonify({'jobs': [job_manager.view(k, v) for k, v in jobs_list]})
+
+@app.route('/api/jobs/<job_id>')
+@auth_required
+def job_status(job_id):
+    # 统一的任务状态：文件任务读 JobManager；其他 Celery 任务 (压缩) 按 AsyncResult 转换为同样的格式
+    job = job_manager.get(job_id)
+    if job: return jsonify(job_manager.view(job_id, job))
+    from tasks import celery
+    task = celery.AsyncResult(job_id)
+    res = {'id': job_id, 'kind': 'task', 'state': {'PENDING': 'queued', 'STARTED': 'running', 'PROGRESS': 'running', 'SUCCESS': 'success', 'REVOKED': 'cancelled'}.get(task.state, 'failed'), 'error': None}
+    if task.state == 'PROGRESS': res.update(task.info)
+    elif task.state == 'SUCCESS':
+        res['result'] = task.result
+        if isinstance(task.result, dict) and task.result.get('status') == 'Failed': res.update(state='failed', error=task.result.get('error'))
+    elif task.state == 'FAILURE': res['error'] = str(task.result)
+    return jsonify(res)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@auth_required
+def cancel_job(job_id):
+    # 文件任务在下一次进度上报时停止 (复制中的文件会被清理)；其他 Celery 任务仅能撤销尚未开始的
+    job = job_manager.request_cancel(job_id)
+    if job: return jsonify({'status': 'success', 'state': job['state']})
+    from tasks import celery
+    celery.control.revoke(job_id)
+    return jsonify({'status': 'success', 'state': 'cancelled'})
+
 @app.route('/api/download_result')
 @auth_required
 def download_result_file():
     file_path = request.args.get('file')
     return send_file(file_path, as_attachment=True, download_name=os.path.basename(file_path))
 
+def thumb_url(rel_path):
+    # 列表中只按扩展名给出缩略图地址 (不逐个检查缓存文件)，未生成的由 /api/thumb 在首次请求时生成
+    return f"/api/thumb?size=256&path={quote(rel_path)}" if thumb_cache.supports(rel_path) else None
+
+@app.route('/api/thumb')
+@auth_required
+def get_thumbnail():
+    # 缩略图按需生成并缓存；不支持的格式或未安装 Pillow 时直接返回原图
+    rel_path = FileIndex.norm(request.args.get('path', ''))
+    size = request.args.get('size', 256, type=int)
+    if size not in THUMB_SIZES: return jsonify({'error': 'Invalid size'}), 400
+    try:
+        thumb = thumb_cache.get(os.path.join(ROOT_DIR, rel_path), rel_path, size)
+        if thumb: return serve_file(thumb, download_name=os.path.splitext(os.path.basename(rel_path))[0] + '.webp', cache_control='private, no-cache')
+    except FileNotFoundError: return jsonify({'error': 'Not found'}), 404
+    except Exception: pass # 图片损坏等，回退原图
+    return send_storage_file(rel_path, cache_control='private, no-cache')
+
 @app.route('/api/file')
 @auth_required
 def get_file_content():
-    return send_file(os.path.join(ROOT_DIR, request.args.get('path')))
+    return send_storage_file(request.args.get('path'), cache_control='private, no-cache')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
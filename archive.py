@@ -0,0 +1,171 @@
+import os
+import time
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 已经是压缩格式的文件再 deflate 只会浪费 CPU，直接存储 (ZIP_STORED)
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v', '.3gp',
+    '.mp3', '.aac', '.m4a', '.ogg', '.opus', '.flac',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+    '.docx', '.xlsx', '.pptx', '.apk', '.ipa', '.jar', '.dmg', '.pdf',
+}
+CHUNK_SIZE = 1024 * 1024
+SAMPLE_SIZE = 64 * 1024 # 未知扩展名时，取开头一段试压缩判断是否值得 deflate
+PROGRESS_INTERVAL = 0.5
+
+
+def compress_type_for(name):
+    return zipfile.ZIP_STORED if os.path.splitext(name)[1].lower() in INCOMPRESSIBLE_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def choose_compress_type(name, sample):
+    if compress_type_for(name) == zipfile.ZIP_STORED: return zipfile.ZIP_STORED
+    sample = sample[:SAMPLE_SIZE]
+    if len(sample) >= 4096 and len(zlib.compress(sample, 1)) > len(sample) * 0.95: return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_members(abs_paths):
+    """
+    单次遍历待打包路径，产出 (绝对路径, 包内路径, stat)
+    目录以其自身名称为包内根目录 (与原 compress_files_task 行为一致)
+    """
+    for path in abs_paths:
+        if os.path.isfile(path):
+            yield path, os.path.basename(path), os.stat(path)
+        elif os.path.isdir(path):
+            parent_folder = os.path.dirname(path)
+            for root, dirs, files in os.walk(path):
+                for file in files:
+                    abs_path = os.path.join(root, file)
+                    try: yield abs_path, os.path.relpath(abs_path, parent_folder), os.stat(abs_path)
+                    except OSError: pass
+
+
+def make_zipinfo(arcname, st):
+    date_time = max(time.localtime(st.st_mtime)[:6], (1980, 1, 1, 0, 0, 0)) # ZIP 时间戳不能早于 1980
+    zinfo = zipfile.ZipInfo(arcname.replace(os.sep, '/'), date_time)
+    zinfo.file_size = st.st_size
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.compress_type = compress_type_for(arcname)
+    return zinfo
+
+
+class _StreamBuffer:
+    """ZipFile 的只写输出目标：不支持 seek，ZipFile 会自动改用数据描述符 (data descriptor) 格式"""
+    def __init__(self):
+        self.chunks, self.size, self.pos = [], 0, 0
+    def write(self, data):
+        self.chunks.append(bytes(data)); self.size += len(data); self.pos += len(data)
+        return len(data)
+    def tell(self):
+        return self.pos
+    def flush(self):
+        pass
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks, self.size = [], 0
+        return data
+
+
+def stream_zip(abs_paths, chunk_size=CHUNK_SIZE):
+    """边读源文件边生成 ZIP (支持 ZIP64)，不落地临时文件；用作 Response 的 body"""
+    buf = _StreamBuffer()
+    with zipfile.ZipFile(buf, 'w', allowZip64=True) as zf:
+        for abs_path, arcname, st in iter_members(abs_paths):
+            zinfo = make_zipinfo(arcname, st)
+            try:
+                with open(abs_path, 'rb') as src, zf.open(zinfo, 'w') as dst: # 大小已知，超过 4GB 时自动启用 ZIP64
+                    for data in iter(lambda: src.read(chunk_size), b''):
+                        dst.write(data)
+                        if buf.size >= chunk_size: yield buf.pop()
+            except OSError: continue
+            if buf.size: yield buf.pop()
+    yield buf.pop()
+
+
+# --- 物化 ZIP：并行压缩引擎 ---
+# 与 pigz 相同的思路：每个成员切成 CHUNK_SIZE 的块，块之间以 Z_SYNC_FLUSH 对齐、以前一块末尾 32KB 作为预置字典，
+# 各块独立 deflate 后按顺序拼接仍是一条合法的 raw deflate 流。zlib 压缩时会释放 GIL，所以线程池即可吃满多核，
+# 也省去了进程间传递数据的开销。CRC 在读取线程中顺序累加。
+
+def _deflate_chunk(data, zdict, level, last):
+    c = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict) if zdict else zlib.compressobj(level, zlib.DEFLATED, -15)
+    return c.compress(data) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class _Member:
+    def __init__(self, zinfo, st):
+        self.zinfo, self.crc, self.raw_size, self.compress_size = zinfo, 0, 0, 0
+        self.zip64 = st.st_size * 1.05 > zipfile.ZIP64_LIMIT
+
+
+def _begin_member(zf, m):
+    # zipfile 没有写入"已压缩数据"的公开接口，这里按其 _open_to_write/close 的方式直接写本地文件头并登记成员
+    m.zinfo.header_offset = zf.fp.tell()
+    m.zinfo.CRC = m.zinfo.compress_size = m.zinfo.file_size = 0
+    zf.fp.write(m.zinfo.FileHeader(m.zip64))
+
+
+def _end_member(zf, m):
+    m.zinfo.CRC, m.zinfo.file_size, m.zinfo.compress_size = m.crc, m.raw_size, m.compress_size
+    end = zf.fp.tell()
+    zf.fp.seek(m.zinfo.header_offset)
+    zf.fp.write(m.zinfo.FileHeader(m.zip64)) # 长度与占位头一致 (zip64 标志不变)
+    zf.fp.seek(end)
+    zf.filelist.append(m.zinfo); zf.NameToInfo[m.zinfo.filename] = m.zinfo
+    zf.start_dir = end
+
+
+def write_zip(zip_path, members, workers=None, level=6, progress=None):
+    """
+    把 members ([(绝对路径, 包内路径, stat)]，来自 iter_members) 写成 zip_path
+    按扩展名/采样结果逐文件选择 STORED 或 DEFLATED，DEFLATED 成员分块并行压缩
+    progress(files_done, bytes_done, current_name) 最多每 PROGRESS_INTERVAL 秒回调一次 (结束时必回调)
+    """
+    workers = workers or os.cpu_count() or 1
+    window = workers * 4 # 在途块数上限，约束内存占用
+    pending = deque()
+    state = {'files': 0, 'bytes': 0, 'reported': 0, 'name': ''}
+
+    def report(name, force=False):
+        state['name'] = name or state['name']; now = time.time()
+        if progress and (force or now - state['reported'] >= PROGRESS_INTERVAL):
+            state['reported'] = now; progress(state['files'], state['bytes'], state['name'])
+
+    def consume():
+        m, first, last, raw_len, payload = pending.popleft()
+        if first: _begin_member(zf, m)
+        data = payload.result() if hasattr(payload, 'result') else payload
+        zf.fp.write(data); m.compress_size += len(data); state['bytes'] += raw_len
+        if last:
+            _end_member(zf, m); state['files'] += 1
+        report(m.zinfo.filename)
+
+    with zipfile.ZipFile(zip_path, 'w', allowZip64=True) as zf, ThreadPoolExecutor(workers) as pool:
+        for abs_path, arcname, st in members:
+            try: src = open(abs_path, 'rb')
+            except OSError: continue
+            with src:
+                m = _Member(make_zipinfo(arcname, st), st)
+                data = src.read(CHUNK_SIZE)
+                m.zinfo.compress_type = choose_compress_type(arcname, data)
+                first, zdict = True, None
+                while True:
+                    nxt = src.read(CHUNK_SIZE) if data else b''
+                    last = not nxt
+                    m.crc = zlib.crc32(data, m.crc); m.raw_size += len(data)
+                    if m.zinfo.compress_type == zipfile.ZIP_DEFLATED:
+                        payload = pool.submit(_deflate_chunk, data, zdict, level, last)
+                        zdict = data[-32768:] or zdict
+                    else: payload = data
+                    pending.append((m, first, last, len(data), payload))
+                    while len(pending) >= window: consume()
+                    if last: break
+                    first, data = False, nxt
+        while pending: consume()
+    report('', force=True)
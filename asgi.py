@@ -0,0 +1,201 @@
+"""
+异步服务模式：只处理公开分享 /s/<share_id> (含 HLS 分片) 与图床 /img/<share_id>[.<ext>] 的文件发送，管理 API 仍由 gunicorn + Flask 处理
+gunicorn 每个连接占用一个线程，大量慢速下载 (手机网络、视频边播边下) 会把 4x10 个线程占满；
+这里每个连接只是事件循环里的一个协程，磁盘读取 (pread) 放到线程池，发送时 await 等待客户端取走数据 (背压)，
+空闲的慢连接几乎不占资源，数千并发连接也不影响管理界面
+
+启动 (start.sh 中 ASYNC_SERVING=1 时自动启动)：
+    uvicorn asgi:application --host 0.0.0.0 --port 5001 --workers 2
+前端代理把 /s/* 与 /img/* 转发到 5001 端口，其余仍转发到 5000 (见 caddy/Caddyfile)
+响应内容 (提示文字、状态码、ETag/304、单/多区间 206、416、X-Accel-Redirect 卸载、访问计数与指标) 与 Flask 版本一致
+"""
+import os
+import re
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote
+from flask import render_template
+
+import app as cloud
+import metrics
+from serving import evaluate, multipart_parts, CHUNK_SIZE
+
+ASYNC_READ_THREADS = int(os.getenv('ASYNC_READ_THREADS', '32')) # 磁盘读取线程数 (与连接数无关)
+
+SHARE_RE = re.compile(r'^/s/([^/]+)$')
+SHARE_HLS_RE = re.compile(r'^/s/([^/]+)/hls/(.+)$')
+IMG_RE = re.compile(r'^/img/([^/.]+)(?:\.([^/]+))?$')
+TEXT_TYPE = 'text/html; charset=utf-8'
+
+_executor = ThreadPoolExecutor(ASYNC_READ_THREADS, thread_name_prefix='asgi-io')
+
+
+def _run(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+class _Headers:
+    """请求头映射 (不区分大小写)，供 serving.evaluate 使用"""
+    def __init__(self, raw):
+        self._h = {}
+        for k, v in raw: self._h[k.decode('latin-1').lower()] = v.decode('latin-1')
+    def get(self, name, default=None):
+        return self._h.get(name.lower(), default)
+
+
+def _render_share(share_id, info):
+    with cloud.app.app_context():
+        return render_template('share.html', filename=info['file_name'], download_url=f"/s/{quote(share_id)}?dl=1", hls_url=cloud.share_hls_url(share_id, info))
+
+
+class _Exchange:
+    """单个请求：记录状态码与实际发送的字节数，监听客户端断开"""
+    def __init__(self, scope, receive, send, endpoint):
+        self.scope, self.receive, self._send, self.endpoint = scope, receive, send, endpoint
+        self.method, self.start, self.status, self.sent, self.content_range = scope['method'], time.perf_counter(), 0, 0, ''
+        self.headers = _Headers(scope['headers'])
+        self.disconnected = asyncio.Event()
+
+    async def watch(self):
+        # GET/HEAD 没有请求体，收到 http.disconnect 说明客户端已关闭连接，停止读取文件
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect': self.disconnected.set(); return
+
+    async def start_response(self, status, headers, content_type=None, length=None):
+        self.status, self.content_range = status, headers.get('Content-Range', '')
+        headers = dict(headers)
+        if content_type: headers['Content-Type'] = content_type
+        if length is not None: headers['Content-Length'] = str(length)
+        await self._send({'type': 'http.response.start', 'status': status,
+                          'headers': [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]})
+        metrics.REQUEST_SECONDS.labels(self.method, self.endpoint, str(status)).observe(time.perf_counter() - self.start)
+
+    async def body(self, data, more=False):
+        if self.method == 'HEAD': data = b''
+        await self._send({'type': 'http.response.body', 'body': data, 'more_body': more})
+
+    async def text(self, text, status=200):
+        data = text.encode('utf-8')
+        await self.start_response(status, {}, TEXT_TYPE, len(data))
+        await self.body(data)
+
+    async def stream(self, fd, segments):
+        """segments: bytes (分段头) 或 (start, stop) 文件区间；每块 CHUNK_SIZE，await send 直到客户端取走才读下一块"""
+        if self.method != 'HEAD':
+            for seg in segments:
+                if self.disconnected.is_set(): return
+                if isinstance(seg, bytes): await self.body(seg, True); continue
+                pos, stop = seg
+                while pos < stop and not self.disconnected.is_set():
+                    data = await _run(os.pread, fd, min(CHUNK_SIZE, stop - pos), pos)
+                    if not data: break
+                    await self.body(data, True)
+                    pos += len(data); self.sent += len(data)
+        await self.body(b'')
+
+
+async def _send_storage_file(ex, rel_path, **kwargs):
+    """对应 app.send_storage_file；文件不存在时抛出 FileNotFoundError 等 (由调用方决定返回内容)"""
+    await _send_file(ex, os.path.join(cloud.ROOT_DIR, rel_path), cloud.storage_offload(rel_path), **kwargs)
+
+
+async def _send_file(ex, abs_path, offload=None, **kwargs):
+    status, headers, ranges, size, content_type = await _run(evaluate, abs_path, ex.headers, kwargs.get('download_name'),
+                                                             False, kwargs.get('cache_control', 'no-cache'))
+    if status == 304:
+        await ex.start_response(304, headers)
+        return await ex.body(b'')
+
+    if offload:
+        headers.pop('Content-Range', None); headers[offload[0]] = offload[1]
+        await ex.start_response(200, headers, content_type, 0)
+        return await ex.body(b'')
+
+    if status == 416:
+        await ex.start_response(416, headers, None, 0)
+        return await ex.body(b'')
+
+    fd = await _run(os.open, abs_path, os.O_RDONLY)
+    try:
+        if ranges is None: segments, length = [(0, size)], size
+        elif len(ranges) == 1: segments, length = [ranges[0]], ranges[0][1] - ranges[0][0]
+        else:
+            parts, trailer, boundary, length = multipart_parts(ranges, size, content_type)
+            segments = [s for head, a, b in parts for s in (head, (a, b), b'\r\n')] + [trailer]
+            content_type = f'multipart/byteranges; boundary={boundary}'
+        await ex.start_response(status, headers, content_type, length)
+        await ex.stream(fd, segments)
+    finally: os.close(fd)
+
+
+async def public_share_link(ex, share_id):
+    info = await _run(cloud.share_manager.get_file_info, share_id)
+    if not info: return await ex.text("分享链接已过期或不存在", 404)
+    if not await _run(os.path.exists, os.path.join(cloud.ROOT_DIR, info['file_path'])): return await ex.text("源文件已被删除", 404)
+    if info['is_dir']: return await ex.text(f"这是一个文件夹 ({info['file_name']})，暂不支持下载。", 200)
+
+    if parse_qs(ex.scope.get('query_string', b'').decode('latin-1')).get('dl') == ['1']:
+        await _send_storage_file(ex, info['file_path'], download_name=info['file_name'], cache_control='public, no-cache')
+        return True
+
+    html = await _run(_render_share, share_id, info)
+    await ex.text(html)
+
+
+async def public_share_hls(ex, share_id, name):
+    # HLS 分片数量多，不计入分享的访问次数与流量
+    info = await _run(cloud.share_manager.get_file_info, share_id)
+    path = info and await _run(cloud.share_hls_file, info, name)
+    if not path: return await ex.text("404 Not Found", 404)
+    try: await _send_file(ex, path, download_name=os.path.basename(name), cache_control=f'public, max-age={cloud.HLS_MAX_AGE}')
+    except FileNotFoundError:
+        if ex.status: raise
+        await ex.text("404 Not Found", 404)
+
+
+async def image_hosting(ex, share_id):
+    info = await _run(cloud.share_manager.get_file_info, share_id)
+    if not info: return await ex.text("404 Not Found", 404)
+    try: await _send_storage_file(ex, info['file_path'], cache_control=f'public, max-age={cloud.IMG_CACHE_MAX_AGE}, immutable')
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        if ex.status: raise # 响应头已发出，无法再改为 404
+        return await ex.text("404 Not Found", 404)
+    return True
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup': await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await _run(cloud.share_counter.flush) # 进程退出前写回内存中的访问计数
+            await send({'type': 'lifespan.shutdown.complete'}); return
+
+
+def _route(path):
+    """(处理函数, 参数, 指标中的路由模板)，与 Flask 的路由模板写法一致"""
+    m = SHARE_RE.match(path)
+    if m: return public_share_link, m.groups(), '/s/<share_id>'
+    m = SHARE_HLS_RE.match(path)
+    if m: return public_share_hls, m.groups(), '/s/<share_id>/hls/<path:name>'
+    m = IMG_RE.match(path)
+    if m: return image_hosting, m.groups()[:1], '/img/<share_id>.<ext>' if m.group(2) else '/img/<share_id>'
+    return None, (), 'unmatched'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan': return await _lifespan(receive, send)
+    if scope['type'] != 'http': return
+
+    handler, args, endpoint = _route(scope['path'])
+    ex = _Exchange(scope, receive, send, endpoint)
+    watcher = asyncio.ensure_future(ex.watch())
+    try:
+        if handler is None: return await ex.text("404 Not Found", 404)
+        if ex.method not in ('GET', 'HEAD'): return await ex.text("405 Method Not Allowed", 405)
+        if await handler(ex, *args):
+            # 与 Flask 版本一致：只统计文件响应；流量按实际发出的字节数 (客户端中途断开时不多算)
+            cloud.share_counter.count(args[0], ex.status, ex.sent, ex.content_range)
+    finally: watcher.cancel()
@@ -0,0 +1,389 @@
+"""
+基准/压测脚本：生成合成存储目录，分别通过 Flask test client 与本地 gunicorn 测量核心接口的吞吐与延迟，结果保存为 JSON
+
+    python benchmark.py --files 20000 --huge-mb 512 --output bench_main.json
+    python benchmark.py --target gunicorn --workers 4 --concurrency 16 --output bench_branch.json
+    python benchmark.py --compare bench_main.json bench_branch.json
+
+Celery 默认同步执行 (CELERY_EAGER=1，任务耗时计入提交请求)；--celery redis 则连接 --redis-url 并启动一个本地 worker
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_USER, BENCH_PASS = 'bench', 'bench'
+
+
+# --- 合成数据 ---
+
+def build_tree(root, files, fanout, small_size, list_size, depth, huge_count, huge_mb, images, huge_random=False):
+    """
+    small/dNNN/   大量小文件 (每个目录 fanout 个)      list/  单个目录 list_size 个文件 (测 /api/list)
+    deep/l0/.../  depth 层嵌套                         huge/  huge_count 个 huge_mb MB 的大文件 (默认稀疏文件，生成快)
+    images/       小 JPEG (测 /img、/api/category)      work/  上传/回收站操作的工作目录
+    """
+    rnd = random.Random(42)
+    payload = rnd.randbytes(small_size) if hasattr(rnd, 'randbytes') else os.urandom(small_size)
+    for i in range(files):
+        d = os.path.join(root, 'small', f"d{i // fanout:04d}")
+        if i % fanout == 0: os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, f"f{i:06d}.txt"), 'wb') as f: f.write(payload)
+    os.makedirs(os.path.join(root, 'list'))
+    for i in range(list_size):
+        with open(os.path.join(root, 'list', f"item_{i:05d}.dat"), 'wb') as f: f.write(payload[:rnd.randint(1, small_size)])
+    deep = os.path.join(root, 'deep', *[f"l{i}" for i in range(depth)])
+    os.makedirs(deep)
+    with open(os.path.join(deep, 'leaf.txt'), 'wb') as f: f.write(payload)
+    os.makedirs(os.path.join(root, 'huge'))
+    for i in range(huge_count):
+        with open(os.path.join(root, 'huge', f"huge_{i}.bin"), 'wb') as f:
+            if huge_random:
+                for _ in range(huge_mb): f.write(os.urandom(1024 * 1024))
+            else: f.truncate(huge_mb * 1024 * 1024)
+    os.makedirs(os.path.join(root, 'images'))
+    jpeg = _tiny_jpeg()
+    for i in range(images):
+        with open(os.path.join(root, 'images', f"img_{i:04d}.jpg"), 'wb') as f: f.write(jpeg)
+    os.makedirs(os.path.join(root, 'work'))
+
+
+def _tiny_jpeg():
+    try:
+        from io import BytesIO
+        from PIL import Image
+        buf = BytesIO(); Image.new('RGB', (640, 480), (120, 160, 200)).save(buf, 'JPEG', quality=85)
+        return buf.getvalue()
+    except ImportError: # 没有 Pillow 时只测发送路径，内容不必是合法图片
+        return b'\xff\xd8\xff\xe0' + os.urandom(60 * 1024)
+
+
+def _multipart(field, filename, data, extra):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode() for k, v in extra.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+# --- 客户端：两种目标提供同样的接口 request(...) -> (status, 响应体字节数)，json(...) -> (status, 解析后的 JSON) ---
+
+class TestClientTarget:
+    name = 'flask'
+
+    def __init__(self, app_module):
+        self.app = app_module.app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+            with client.session_transaction() as s: s['logged_in'] = True
+        return client
+
+    def request(self, method, url, body=None, headers=None):
+        resp = self._client().open(url, method=method, data=body, headers=headers or {}, buffered=False)
+        size = 0
+        for chunk in resp.response: size += len(chunk) # 与真实客户端一样把响应体完整读完
+        resp.close()
+        return resp.status_code, size
+
+    def json(self, method, url, payload=None):
+        resp = self._client().open(url, method=method, json=payload)
+        return resp.status_code, resp.get_json()
+
+    def close(self):
+        pass
+
+
+class GunicornTarget:
+    name = 'gunicorn'
+
+    def __init__(self, env, workers, threads):
+        self.port = _free_port()
+        self.proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads), '-b', f'127.0.0.1:{self.port}',
+                                      '--timeout', '0', '--log-level', 'warning', 'app:app'], cwd=BASE_DIR, env=env)
+        self._local = threading.local()
+        deadline = time.time() + 30
+        while True:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+                conn.request('POST', '/api/login', body=json.dumps({'username': BENCH_USER, 'password': BENCH_PASS}), headers={'Content-Type': 'application/json'})
+                resp = conn.getresponse(); resp.read()
+                self.cookie = resp.getheader('Set-Cookie').split(';', 1)[0]
+                break
+            except (OSError, AttributeError):
+                if time.time() > deadline or self.proc.poll() is not None: raise RuntimeError('gunicorn failed to start')
+                time.sleep(0.3)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None: conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=600)
+        return conn
+
+    def request(self, method, url, body=None, headers=None):
+        headers = {**(headers or {}), 'Cookie': self.cookie}
+        for attempt in range(2): # keep-alive 连接被服务端关闭时重连一次
+            conn = self._conn()
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                resp = conn.getresponse()
+                size = 0
+                for chunk in iter(lambda: resp.read(1024 * 1024), b''): size += len(chunk)
+                return resp.status, size
+            except (http.client.HTTPException, ConnectionError):
+                conn.close(); self._local.conn = None
+                if attempt: raise
+
+    def json(self, method, url, payload=None):
+        conn = self._conn()
+        conn.request(method, url, body=json.dumps(payload) if payload is not None else None, headers={'Content-Type': 'application/json', 'Cookie': self.cookie})
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read() or b'null')
+
+    def close(self):
+        self.proc.terminate()
+        try: self.proc.wait(10)
+        except subprocess.TimeoutExpired: self.proc.kill()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0)); return s.getsockname()[1]
+
+
+# --- 场景：每个场景返回一个 op()，执行一次完整操作并返回 (是否成功, 传输字节数) ---
+
+def _ok(status): return 200 <= status < 300
+
+
+def scenarios(target, ctx):
+    def get(url):
+        def op():
+            status, size = target.request('GET', url)
+            return _ok(status), size
+        return op
+
+    def upload():
+        data = os.urandom(ctx['upload_size'])
+        body, ctype = _multipart('file', f"up_{uuid.uuid4().hex[:8]}.bin", data, {'path': 'work'})
+        status, size = target.request('POST', '/api/upload', body, {'Content-Type': ctype})
+        return _ok(status), len(body)
+
+    def upload_chunked():
+        data = os.urandom(ctx['upload_size'])
+        status, info = target.json('POST', '/api/upload/init', {'path': 'work', 'name': f"chunk_{uuid.uuid4().hex[:8]}.bin", 'size': len(data)})
+        if not _ok(status): return False, 0
+        uid = info['upload_id']
+        status, _ = target.request('PUT', f"/api/upload/{uid}?offset=0", data, {'Content-Type': 'application/octet-stream'})
+        status2, _ = target.json('POST', f"/api/upload/{uid}/finalize")
+        return _ok(status) and _ok(status2), len(data)
+
+    def archive_stream():
+        status, info = target.json('POST', '/api/archive/stream', {'files': ['small/d0000', 'images']})
+        if not _ok(status): return False, 0
+        status, size = target.request('GET', info['url'])
+        return _ok(status), size
+
+    def archive_task():
+        # Celery 打包 (CELERY_EAGER 时在请求内完成)；产物写在源文件旁边，测完删除
+        status, info = target.json('POST', '/api/archive', {'files': ['small/d0000']})
+        for name in os.listdir(os.path.join(ctx['storage'], 'small')):
+            if name.startswith('archive_') and name.endswith('.zip'):
+                try: os.remove(os.path.join(ctx['storage'], 'small', name))
+                except OSError: pass
+        return _ok(status), 0
+
+    def trash_cycle():
+        # 删除 (移入回收站) + 还原 一个小目录；两次都是后台任务，轮询到结束
+        status, info = target.json('POST', '/api/delete', {'files': ['deep']})
+        job = _wait_job(target, info.get('job_id')) if _ok(status) else None
+        if not job or job['state'] != 'success' or job['results'][0]['status'] != 'success': return False, 0
+        status, info = target.json('POST', '/api/trash/restore', {'items': [job['results'][0]['id']]})
+        job = _wait_job(target, info.get('job_id')) if _ok(status) else None
+        return bool(job and job['state'] == 'success'), 0
+
+    return {
+        'api_list': get(f"/api/list?path=list&limit={ctx['page_size']}"),
+        'api_list_deep': get('/api/list?path=' + quote('deep/' + '/'.join(f"l{i}" for i in range(ctx['depth'])))),
+        'api_category': get('/api/category?type=image&page=1'),
+        'img': get(f"/img/{ctx['img_share']}.jpg"),
+        's_dl_huge': get(f"/s/{ctx['huge_share']}?dl=1"),
+        'upload': upload,
+        'upload_chunked': upload_chunked,
+        'archive_stream': archive_stream,
+        'archive_task': archive_task,
+        'trash_cycle': trash_cycle,
+    }
+
+
+def _wait_job(target, job_id, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, job = target.json('GET', f"/api/jobs/{job_id}")
+        if job and job.get('state') in ('success', 'failed', 'cancelled'): return job
+        time.sleep(0.05)
+    return None
+
+
+# --- 统计 ---
+
+def percentile(sorted_values, p):
+    if not sorted_values: return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1)) # nearest-rank
+    return sorted_values[k]
+
+
+def run_scenario(op, iterations, concurrency, warmup):
+    for _ in range(warmup): op()
+    latencies, errors, total_bytes, lock = [], 0, 0, threading.Lock()
+
+    def one(_):
+        nonlocal errors, total_bytes
+        start = time.perf_counter()
+        try: ok, size = op()
+        except Exception: ok, size = False, 0
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed); total_bytes += size
+            if not ok: errors += 1
+
+    wall = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool: list(pool.map(one, range(iterations)))
+    else:
+        for i in range(iterations): one(i)
+    wall = time.perf_counter() - wall
+    latencies.sort()
+    return {
+        'iterations': iterations, 'concurrency': concurrency, 'errors': errors, 'wall_seconds': round(wall, 4),
+        'ops_per_sec': round(iterations / wall, 2) if wall else None,
+        'mb_per_sec': round(total_bytes / wall / 1048576, 2) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 3) for p in (50, 90, 99)},
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+def compare(a_path, b_path):
+    with open(a_path) as f: a = json.load(f)
+    with open(b_path) as f: b = json.load(f)
+    print(f"{'target/scenario':<32}{'p50 A':>10}{'p50 B':>10}{'Δ':>8}{'p99 A':>10}{'p99 B':>10}{'Δ':>8}{'ops/s A':>10}{'ops/s B':>10}")
+    for target, results in b['results'].items():
+        for name, rb in results.items():
+            ra = a['results'].get(target, {}).get(name)
+            if not ra: continue
+            d50 = (rb['p50_ms'] - ra['p50_ms']) / ra['p50_ms'] * 100 if ra['p50_ms'] else 0
+            d99 = (rb['p99_ms'] - ra['p99_ms']) / ra['p99_ms'] * 100 if ra['p99_ms'] else 0
+            print(f"{target + '/' + name:<32}{ra['p50_ms']:>10.2f}{rb['p50_ms']:>10.2f}{d50:>+7.0f}%{ra['p99_ms']:>10.2f}{rb['p99_ms']:>10.2f}{d99:>+7.0f}%{ra['ops_per_sec']:>10.1f}{rb['ops_per_sec']:>10.1f}")
+
+
+def _git_rev():
+    try: return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--target', choices=['flask', 'gunicorn', 'both'], default='both')
+    ap.add_argument('--scenarios', default='', help='逗号分隔，只运行这些场景')
+    ap.add_argument('--files', type=int, default=5000, help='小文件数量')
+    ap.add_argument('--fanout', type=int, default=500, help='每个目录的小文件数')
+    ap.add_argument('--small-size', type=int, default=4096)
+    ap.add_argument('--list-size', type=int, default=3000, help='/api/list 测试目录中的文件数')
+    ap.add_argument('--page-size', type=int, default=1000)
+    ap.add_argument('--depth', type=int, default=64, help='嵌套目录深度')
+    ap.add_argument('--huge-count', type=int, default=1)
+    ap.add_argument('--huge-mb', type=int, default=256)
+    ap.add_argument('--huge-random', action='store_true', help='大文件写入随机数据 (默认稀疏文件)')
+    ap.add_argument('--images', type=int, default=300)
+    ap.add_argument('--upload-size', type=int, default=256 * 1024)
+    ap.add_argument('--iterations', type=int, default=50)
+    ap.add_argument('--heavy-iterations', type=int, default=5, help='大文件下载/打包场景的次数')
+    ap.add_argument('--warmup', type=int, default=2)
+    ap.add_argument('--concurrency', type=int, default=1)
+    ap.add_argument('--workers', type=int, default=4, help='gunicorn worker 数')
+    ap.add_argument('--threads', type=int, default=10, help='gunicorn 每个 worker 的线程数')
+    ap.add_argument('--celery', choices=['eager', 'redis'], default='eager')
+    ap.add_argument('--redis-url', default='redis://localhost:6379/15')
+    ap.add_argument('--workdir', help='数据目录 (默认临时目录，结束后删除)')
+    ap.add_argument('--label', help='结果标签 (默认当前 git 提交)')
+    ap.add_argument('--output', default='bench_results.json')
+    ap.add_argument('--compare', nargs=2, metavar=('A.json', 'B.json'))
+    args = ap.parse_args()
+    if args.compare: return compare(*args.compare)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cloud-bench-')
+    storage = os.path.join(workdir, 'storage')
+    env = {**os.environ, 'STORAGE_PATH': storage, 'TRASH_PATH': os.path.join(workdir, 'trash'), 'SHARE_PATH': os.path.join(workdir, 'shares'),
+           'META_PATH': os.path.join(workdir, 'meta'), 'ADMIN_USER': BENCH_USER, 'ADMIN_PASS': BENCH_PASS,
+           'CELERY_EAGER': '1' if args.celery == 'eager' else '0', 'REDIS_URL': args.redis_url}
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    os.environ.update(env)
+    print(f"生成数据: {workdir}", file=sys.stderr)
+    t = time.perf_counter()
+    build_tree(storage, args.files, args.fanout, args.small_size, args.list_size, args.depth, args.huge_count, args.huge_mb, args.images, args.huge_random)
+    tree_seconds = time.perf_counter() - t
+
+    celery_worker = None
+    if args.celery == 'redis':
+        celery_worker = subprocess.Popen([sys.executable, '-m', 'celery', '-A', 'tasks', 'worker', '--loglevel=warning', '--concurrency', '2'], cwd=BASE_DIR, env=env)
+
+    sys.path.insert(0, BASE_DIR)
+    import app as app_module # 导入即初始化索引等，环境变量必须先设置好
+    t = time.perf_counter()
+    while not app_module.file_index.ready: time.sleep(0.1)
+    index_seconds = time.perf_counter() - t
+
+    client = TestClientTarget(app_module)
+    _, res = client.json('POST', '/api/share/create', {'files': ['images/img_0000.jpg', 'huge/huge_0.bin']})
+    ctx = {'storage': storage, 'page_size': args.page_size, 'depth': args.depth, 'upload_size': args.upload_size,
+           'img_share': res['links'][0].rsplit('/', 1)[1].split('.')[0], 'huge_share': res['links'][1].rsplit('/', 1)[1]}
+    heavy = {'s_dl_huge', 'archive_stream', 'archive_task', 'trash_cycle'}
+    selected = set(filter(None, args.scenarios.split(',')))
+
+    results = {}
+    targets = ['flask', 'gunicorn'] if args.target == 'both' else [args.target]
+    try:
+        for name in targets:
+            target = client if name == 'flask' else GunicornTarget(env, args.workers, args.threads)
+            try:
+                results[name] = {}
+                for scenario, op in scenarios(target, ctx).items():
+                    if selected and scenario not in selected: continue
+                    iterations = args.heavy_iterations if scenario in heavy else args.iterations
+                    print(f"[{name}] {scenario} x{iterations}", file=sys.stderr)
+                    results[name][scenario] = run_scenario(op, iterations, args.concurrency, 1 if scenario in heavy else args.warmup)
+            finally: target.close()
+    finally:
+        if celery_worker: celery_worker.terminate()
+
+    report = {
+        'label': args.label or _git_rev(), 'git': _git_rev(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'celery': args.celery,
+        'params': {k: v for k, v in vars(args).items() if k not in ('compare', 'output', 'label', 'workdir')},
+        'setup': {'tree_seconds': round(tree_seconds, 3), 'index_seconds': round(index_seconds, 3)},
+        'results': results,
+    }
+    with open(args.output, 'w') as f: json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2), file=sys.stderr)
+    print(f"结果已保存: {args.output}", file=sys.stderr)
+    if not args.workdir: shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import os
+import uuid
+import fcntl
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+FICLONE = 0x40049409 # linux/fs.h: _IOW(0x94, 9, int)，btrfs / XFS(reflink=1) / bcachefs 支持
+HASH_BUFSIZE = 1024 * 1024
+
+
+def file_digest(path, bufsize=HASH_BUFSIZE):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for buf in iter(lambda: f.read(bufsize), b''): h.update(buf)
+    return h.hexdigest()
+
+
+class DedupStore:
+    """
+    内容寻址去重：记录 路径 -> 数据块 (blob) 的归属，复制和重复上传时让新文件与已有文件共享数据
+    mode='reflink': 只用 FICLONE 克隆 (文件系统层面写时复制)，不支持时退回普通复制
+    mode='auto'   : 先尝试 reflink，不支持时在同一文件系统内使用硬链接
+    硬链接没有真正的写时复制，靠本程序所有写入都走 "写临时文件 + os.replace" 来保证：替换只会断开链接，不会改到另一份
+    blob 相同即共享同一份物理数据；digest (sha256) 只在哈希过的文件上有，用于识别重复上传
+    """
+    def __init__(self, db_path, root_dir, mode='auto', tmp_suffix='.part'):
+        self.db_path, self.root_dir, self.mode, self.tmp_suffix = db_path, root_dir, mode, tmp_suffix
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                path TEXT PRIMARY KEY, blob TEXT NOT NULL, digest TEXT, size INTEGER NOT NULL,
+                ino INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, method TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_blobs_digest ON blobs (digest, size) WHERE digest IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS idx_blobs_blob ON blobs (blob);
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def norm(rel_path):
+        rel_path = os.path.normpath(rel_path or '').replace('\\', '/').strip('/')
+        return '' if rel_path == '.' else rel_path
+
+    def _abs(self, rel_path):
+        return os.path.join(self.root_dir, rel_path)
+
+    def _tmp_path(self, dst):
+        # 隐藏的 .part 文件：目录列表与文件索引都会忽略
+        return os.path.join(os.path.dirname(dst), f".{uuid.uuid4().hex}.{os.path.basename(dst)}{self.tmp_suffix}")
+
+    # --- 记录 ---
+    def _valid(self, row):
+        """记录之后文件被外部修改/删除/替换则作废 (硬链接的多个路径共享 inode 与 mtime，一起作废)"""
+        try: st = os.stat(self._abs(row[0]))
+        except OSError: return False
+        return (st.st_size, st.st_ino, st.st_mtime_ns) == (row[3], row[4], row[5])
+
+    def _record(self, conn, rel_path, blob, digest, method):
+        st = os.stat(self._abs(rel_path))
+        conn.execute('INSERT OR REPLACE INTO blobs (path, blob, digest, size, ino, mtime_ns, method) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (rel_path, blob, digest, st.st_size, st.st_ino, st.st_mtime_ns, method))
+
+    def _source(self, conn, rel_path):
+        """源文件的 (blob, digest)；未登记或已失效时登记为新 blob (不哈希，复制时不额外读一遍源文件)"""
+        row = conn.execute('SELECT path, blob, digest, size, ino, mtime_ns FROM blobs WHERE path = ?', (rel_path,)).fetchone()
+        if row and self._valid(row): return row[1], row[2]
+        blob = 'i:' + uuid.uuid4().hex
+        self._record(conn, rel_path, blob, None, 'origin')
+        return blob, None
+
+    def remove_paths(self, rel_paths):
+        params = [(p, p + '/', p + '0') for p in map(self.norm, rel_paths) if p]
+        if not params: return
+        conn = self._conn()
+        with conn: conn.executemany('DELETE FROM blobs WHERE path = ? OR (path >= ? AND path < ?)', params)
+
+    def move_path(self, old_rel, new_rel):
+        old_rel, new_rel = self.norm(old_rel), self.norm(new_rel)
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM blobs WHERE path = ? OR (path >= ? AND path < ?)', (new_rel, new_rel + '/', new_rel + '0'))
+            conn.execute('UPDATE blobs SET path = ? || substr(path, ?) WHERE path = ? OR (path >= ? AND path < ?)',
+                         (new_rel, len(old_rel) + 1, old_rel, old_rel + '/', old_rel + '0'))
+
+    # --- 克隆 ---
+    def clone_file(self, src, dst, allow_copy=True):
+        """
+        让 dst 与 src 共享数据，返回 'reflink' / 'hardlink' / 'copy'；都不可行且 allow_copy=False 时返回 None
+        先写临时文件再原子替换：dst 原本是硬链接时，替换只影响 dst 这一个路径
+        """
+        tmp = self._tmp_path(dst)
+        try:
+            with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst: fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, tmp); os.replace(tmp, dst)
+            return 'reflink'
+        except OSError:
+            try: os.remove(tmp)
+            except OSError: pass
+        if self.mode == 'auto':
+            try:
+                os.link(src, tmp); os.replace(tmp, dst)
+                return 'hardlink'
+            except OSError:
+                try: os.remove(tmp)
+                except OSError: pass
+        if not allow_copy: return None
+        shutil.copy2(src, tmp); os.replace(tmp, dst)
+        return 'copy'
+
+    def copy_file(self, src_rel, dst_rel, fallback=None):
+        """复制单个文件；无法共享数据时用 fallback(src, dst) 复制 (默认经临时文件 shutil.copy2)"""
+        src, dst = self._abs(src_rel), self._abs(dst_rel)
+        method = self.clone_file(src, dst, allow_copy=fallback is None)
+        if method is None: fallback(src, dst); method = 'copy'
+        conn = self._conn()
+        with conn:
+            if method == 'copy': conn.execute('DELETE FROM blobs WHERE path = ?', (dst_rel,))
+            else:
+                blob, digest = self._source(conn, src_rel)
+                self._record(conn, dst_rel, blob, digest, method)
+        return method
+
+    # --- 上传 ---
+    def find_duplicate(self, digest, size, exclude=None):
+        conn = self._conn()
+        rows = conn.execute('SELECT path, blob, digest, size, ino, mtime_ns FROM blobs WHERE digest = ? AND size = ?', (digest, size)).fetchall()
+        for row in rows:
+            if row[0] == exclude: continue
+            if self._valid(row): return row
+            with conn: conn.execute('DELETE FROM blobs WHERE path = ?', (row[0],))
+        return None
+
+    def commit_upload(self, tmp_path, rel_path, digest=None):
+        """
+        把已完整写入的临时文件落到 rel_path：内容与已登记文件相同时改为共享其数据并丢弃临时文件
+        返回 True 表示去重成功
+        """
+        rel_path = self.norm(rel_path); dst = self._abs(rel_path)
+        digest = digest or file_digest(tmp_path)
+        size = os.path.getsize(tmp_path)
+        dup = self.find_duplicate(digest, size, exclude=rel_path) if size else None
+        method = dup and self.clone_file(self._abs(dup[0]), dst, allow_copy=False)
+        if method: os.remove(tmp_path)
+        else: os.replace(tmp_path, dst)
+        conn = self._conn()
+        with conn: self._record(conn, rel_path, dup[1] if method else 'sha256:' + digest, digest, method or 'upload')
+        return bool(method)
+
+    # --- 统计 ---
+    def report(self):
+        """逻辑大小 (各路径之和) 与物理大小 (每个 blob 只算一次) 之差即节省的空间；顺带清理失效记录"""
+        conn = self._conn()
+        rows = conn.execute('SELECT path, blob, digest, size, ino, mtime_ns, method FROM blobs').fetchall()
+        stale = [(r[0],) for r in rows if not self._valid(r)]
+        if stale:
+            with conn: conn.executemany('DELETE FROM blobs WHERE path = ?', stale)
+        stale = {s[0] for s in stale}
+        live = [r for r in rows if r[0] not in stale]
+        blobs, methods = {}, {}
+        for r in live:
+            blobs[r[1]] = max(blobs.get(r[1], 0), r[3])
+            methods[r[6]] = methods.get(r[6], 0) + 1
+        logical = sum(r[3] for r in live); physical = sum(blobs.values())
+        return {'files': len(live), 'blobs': len(blobs), 'logical_bytes': logical, 'physical_bytes': physical,
+                'saved_bytes': logical - physical, 'methods': methods}
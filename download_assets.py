@@ -14,6 +14,11 @@ assets = [
         "folder": "static/css",
         "name": "tailwind.css"
     },
+    {
+        "url": "https://cdn.staticfile.org/hls.js/1.4.10/hls.min.js",
+        "folder": "static/js",
+        "name": "hls.js"
+    },
     {
         "url": "https://cdn.staticfile.org/font-awesome/6.4.0/css/all.min.css",
         "folder": "static/css",
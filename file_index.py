@@ -0,0 +1,390 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from metrics import scan_timer
+
+
+# 待索引内容的部分索引：未开启内容索引时 content_mtime 恒为空，索引覆盖所有行、只增加写入开销，因此按需创建 (见 _init_schema)
+CONTENT_PENDING_INDEX = 'CREATE INDEX IF NOT EXISTS idx_files_content_pending ON files (ext) WHERE content_mtime IS NOT mtime'
+
+# v2: 文件名 trigram 全文索引 (子串/模糊搜索) + 可选的文本内容索引
+# files_fts 以 files 表为外部内容、按 rowid 关联，由触发器同步，所有增量维护路径自动覆盖
+# 注意：files 表没有 INTEGER PRIMARY KEY，不要对索引库执行 VACUUM (会重排 rowid)
+SCHEMA_V2 = [
+    'ALTER TABLE files ADD COLUMN content_mtime REAL',
+    'CREATE INDEX IF NOT EXISTS idx_files_name_nocase ON files (name COLLATE NOCASE)',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, content='files', content_rowid='rowid', tokenize='trigram')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5(body, tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts (rowid, name) VALUES (new.rowid, new.name); END""",
+    """CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+        DELETE FROM content_fts WHERE rowid = old.rowid; END""",
+    # 只在文件名确实变化时更新全文索引 (upsert 总会 SET name = excluded.name)
+    """CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE OF name ON files WHEN old.name IS NOT new.name BEGIN
+        INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+        INSERT INTO files_fts (rowid, name) VALUES (new.rowid, new.name); END""",
+    "INSERT INTO files_fts (files_fts) VALUES ('rebuild')",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('content_claim', 0)",
+]
+
+# v3: 目录聚合 (递归大小 / 文件数)，由 files 表上的触发器随每次增删改同步到所有上级目录 (含根目录 '')
+# ancestors() 是在每个连接上注册的 Python 函数，用其他工具直接改 files 表会报错 (而不是悄悄算错)
+SCHEMA_V3 = [
+    'CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, size INTEGER NOT NULL, files INTEGER NOT NULL) WITHOUT ROWID',
+    """CREATE TRIGGER IF NOT EXISTS files_dirs_ai AFTER INSERT ON files BEGIN
+        INSERT INTO dirs (path, size, files) SELECT value, new.size, 1 FROM json_each(ancestors(new.path)) WHERE true
+        ON CONFLICT(path) DO UPDATE SET size = size + excluded.size, files = files + 1; END""",
+    """CREATE TRIGGER IF NOT EXISTS files_dirs_ad AFTER DELETE ON files BEGIN
+        UPDATE dirs SET size = size - old.size, files = files - 1 WHERE path IN (SELECT value FROM json_each(ancestors(old.path))); END""",
+    """CREATE TRIGGER IF NOT EXISTS files_dirs_au AFTER UPDATE OF path, size ON files WHEN old.path != new.path OR old.size != new.size BEGIN
+        UPDATE dirs SET size = size - old.size, files = files - 1 WHERE path IN (SELECT value FROM json_each(ancestors(old.path)));
+        INSERT INTO dirs (path, size, files) SELECT value, new.size, 1 FROM json_each(ancestors(new.path)) WHERE true
+        ON CONFLICT(path) DO UPDATE SET size = size + excluded.size, files = files + 1; END""",
+]
+REBUILD_DIRS = [
+    'DELETE FROM dirs',
+    'INSERT INTO dirs (path, size, files) SELECT a.value, SUM(f.size), COUNT(*) FROM files f, json_each(ancestors(f.path)) a GROUP BY a.value',
+]
+
+
+def _ancestors(path):
+    """'a/b/c.txt' -> ["", "a", "a/b"] (JSON，供触发器中的 json_each 使用)"""
+    parts = path.split('/')[:-1]
+    return json.dumps([''] + ['/'.join(parts[:i + 1]) for i in range(len(parts))], ensure_ascii=False)
+
+
+def _fts_quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_escape(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class FileIndex:
+    """
+    基于 SQLite 的持久化文件索引 (path / 扩展名 / 分类 / 大小 / 修改时间)
+    由各写操作接口增量维护，后台定期全量对账；同时提供文件名 (及可选的文本内容) 搜索
+    """
+    SORT_COLUMNS = {'mtime': 'mtime', 'size': 'size', 'name': 'name'}
+    BATCH_SIZE = 1000
+    SEARCH_CANDIDATES = 5000 # 子串/模糊搜索先按 bm25 取前 N 个候选，再做精确排序
+    CONTENT_BATCH = 200
+    LEASE_RENEW = 30 # 对账期间每隔多少秒续租 (不超过对账间隔的 1/3)
+
+    def __init__(self, db_path, root_dir, categories, ignore_suffixes=(), content_index=False):
+        self.db_path = db_path
+        self.content_index = content_index
+        self.root_dir = root_dir
+        self.ignore_suffixes = tuple(ignore_suffixes)
+        self.ext_category = {ext: cat for cat, exts in categories.items() for ext in exts}
+        self._local = threading.local()
+        self._content_event = threading.Event()
+        self._init_schema()
+
+    # --- 连接 & 表结构 ---
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid(): # fork 之后不能复用父进程的连接
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.create_function('ancestors', 1, _ancestors, deterministic=True)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, name TEXT NOT NULL, ext TEXT NOT NULL, category TEXT,
+                size INTEGER NOT NULL, mtime REAL NOT NULL, gen INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_cat_mtime ON files (category, mtime);
+            CREATE INDEX IF NOT EXISTS idx_files_cat_size ON files (category, size);
+            CREATE INDEX IF NOT EXISTS idx_files_cat_name ON files (category, name);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('gen', 0), ('reconciled_at', 0), ('reconcile_claim', 0);
+        ''')
+        # 多个 worker 同时启动时只有一个执行升级
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < 2:
+                for stmt in SCHEMA_V2: conn.execute(stmt)
+            if version < 3:
+                for stmt in SCHEMA_V3 + REBUILD_DIRS: conn.execute(stmt)
+                conn.execute('PRAGMA user_version = 3')
+            conn.execute(CONTENT_PENDING_INDEX if self.content_index else 'DROP INDEX IF EXISTS idx_files_content_pending')
+            conn.commit()
+        except Exception:
+            conn.rollback(); raise
+
+    def _meta(self, key):
+        row = self._conn().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def norm(rel_path):
+        rel_path = os.path.normpath(rel_path or '').replace('\\', '/').strip('/')
+        return '' if rel_path == '.' else rel_path
+
+    @staticmethod
+    def _prefix_range(rel_path):
+        # 'a/b/' <= path < 'a/b0'  ('0' 紧随 '/' 之后)，可直接走主键索引
+        return rel_path + '/', rel_path + '0'
+
+    def _row(self, rel_path, name, stat):
+        ext = os.path.splitext(name)[1].lower()
+        return (rel_path, name, ext, self.ext_category.get(ext), stat.st_size, stat.st_mtime)
+
+    def _upsert_rows(self, conn, rows, gen=None):
+        # gen 为空时取当前 gen (增量维护路径)：对账期间写入的记录不会被本轮清除
+        gen_expr = '?' if gen is not None else "(SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'gen')"
+        sql = f'''INSERT INTO files (path, name, ext, category, size, mtime, gen) VALUES (?, ?, ?, ?, ?, ?, {gen_expr})
+                  ON CONFLICT(path) DO UPDATE SET name = excluded.name, ext = excluded.ext, category = excluded.category,
+                  size = excluded.size, mtime = excluded.mtime, gen = excluded.gen'''
+        conn.executemany(sql, [r + (gen,) for r in rows] if gen is not None else rows)
+
+    def _scan(self, rel_dir):
+        # 非递归栈式遍历，只返回普通文件
+        stack = [rel_dir]
+        while stack:
+            cur = stack.pop()
+            try:
+                with os.scandir(os.path.join(self.root_dir, cur)) as entries:
+                    for entry in entries:
+                        if self.ignore_suffixes and entry.name.endswith(self.ignore_suffixes): continue
+                        rel = f"{cur}/{entry.name}" if cur else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False): stack.append(rel)
+                            elif entry.is_file(): yield self._row(rel, entry.name, entry.stat())
+                        except OSError: pass
+            except OSError: pass
+
+    # --- 增量维护 ---
+    def upsert_path(self, rel_path):
+        """新增/覆盖文件或整个目录后调用"""
+        rel_path = self.norm(rel_path)
+        abs_path = os.path.join(self.root_dir, rel_path)
+        conn = self._conn()
+        if os.path.isdir(abs_path):
+            batch = []
+            for row in self._scan(rel_path):
+                batch.append(row)
+                if len(batch) >= self.BATCH_SIZE:
+                    with conn: self._upsert_rows(conn, batch)
+                    batch = []
+            if batch:
+                with conn: self._upsert_rows(conn, batch)
+        elif os.path.isfile(abs_path):
+            with conn: self._upsert_rows(conn, [self._row(rel_path, os.path.basename(rel_path), os.stat(abs_path))])
+        self._content_event.set()
+
+    def remove_path(self, rel_path):
+        """删除文件或目录 (连同其下所有条目)"""
+        self.remove_paths([rel_path])
+
+    def remove_paths(self, rel_paths):
+        params = [(p,) + self._prefix_range(p) for p in map(self.norm, rel_paths) if p]
+        if not params: return
+        conn = self._conn()
+        with conn: conn.executemany('DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)', params)
+
+    def move_path(self, old_rel, new_rel):
+        """重命名/移动: 目录只改前缀，文件重新计算扩展名与分类"""
+        old_rel, new_rel = self.norm(old_rel), self.norm(new_rel)
+        if os.path.isdir(os.path.join(self.root_dir, new_rel)):
+            lo, hi = self._prefix_range(old_rel)
+            conn = self._conn()
+            with conn:
+                conn.execute('DELETE FROM files WHERE path >= ? AND path < ?', self._prefix_range(new_rel))
+                # 带上当前 gen：进行中的对账可能在移动之前遍历过新位置、之后才遍历旧位置，不能把移过来的记录当作已删除
+                conn.execute("UPDATE files SET path = ? || substr(path, ?), gen = (SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'gen') WHERE path >= ? AND path < ?",
+                             (new_rel, len(old_rel) + 1, lo, hi))
+        else:
+            self.remove_path(old_rel)
+            self.upsert_path(new_rel)
+
+    # --- 查询 ---
+    def query_category(self, category, sort='mtime', order='desc', offset=0, limit=None):
+        col = self.SORT_COLUMNS.get(sort, 'mtime')
+        direction = 'ASC' if order == 'asc' else 'DESC'
+        conn = self._conn()
+        total = conn.execute('SELECT COUNT(*) FROM files WHERE category = ?', (category,)).fetchone()[0]
+        sql = f'SELECT path, name, size, mtime FROM files WHERE category = ? ORDER BY {col} {direction}, path {direction}'
+        params = [category]
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'; params += [limit, offset]
+        rows = conn.execute(sql, params).fetchall()
+        return [{'path': r[0], 'name': r[1], 'size': r[2], 'mtime': r[3]} for r in rows], total
+
+    def search(self, q, mode='auto', category=None, offset=0, limit=50):
+        """
+        文件名搜索：prefix 走 name NOCASE 索引；substring 走 trigram 全文索引；fuzzy 按查询词的 trigram 做 OR 匹配 (容忍错字)
+        排序：完全匹配 > 前缀匹配 > 其他，其次 bm25，再按修改时间；不足 3 个字符时自动按前缀搜索
+        """
+        q = q.strip()
+        cat_sql, cat_params = (' AND f.category = ?', [category]) if category else ('', [])
+        if mode == 'prefix' or len(q) < 3:
+            sql = f"SELECT f.path, f.name, f.size, f.mtime FROM files f WHERE f.name LIKE ? ESCAPE '\\' {cat_sql} ORDER BY f.name COLLATE NOCASE LIMIT ? OFFSET ?"
+            params = [_like_escape(q) + '%'] + cat_params + [limit + 1, offset]
+        else:
+            if mode == 'fuzzy': match = ' OR '.join(_fts_quote(t) for t in dict.fromkeys(q[i:i + 3] for i in range(len(q) - 2)))
+            else: match = _fts_quote(q)
+            sql = f'''SELECT f.path, f.name, f.size, f.mtime FROM
+                      (SELECT rowid, rank FROM files_fts WHERE files_fts MATCH ? ORDER BY rank LIMIT {self.SEARCH_CANDIDATES}) m
+                      JOIN files f ON f.rowid = m.rowid WHERE 1 {cat_sql}
+                      ORDER BY CASE WHEN f.name = ? COLLATE NOCASE THEN 0 WHEN f.name LIKE ? ESCAPE '\\' THEN 1 ELSE 2 END, m.rank, f.mtime DESC
+                      LIMIT ? OFFSET ?'''
+            params = [match] + cat_params + [q, _like_escape(q) + '%', limit + 1, offset]
+        rows = self._conn().execute(sql, params).fetchall()
+        return [{'path': r[0], 'name': r[1], 'size': r[2], 'mtime': r[3]} for r in rows[:limit]], len(rows) > limit
+
+    def search_content(self, q, offset=0, limit=50):
+        """文本内容搜索 (需开启内容索引)，返回带高亮片段的结果"""
+        sql = f'''SELECT f.path, f.name, f.size, f.mtime, snippet(content_fts, 0, '[', ']', '…', 12) FROM
+                  (SELECT rowid, rank FROM content_fts WHERE content_fts MATCH ? ORDER BY rank LIMIT {self.SEARCH_CANDIDATES}) m
+                  JOIN content_fts ON content_fts.rowid = m.rowid AND content_fts MATCH ?
+                  JOIN files f ON f.rowid = m.rowid ORDER BY m.rank LIMIT ? OFFSET ?'''
+        match = _fts_quote(q.strip())
+        rows = self._conn().execute(sql, (match, match, limit + 1, offset)).fetchall()
+        return [{'path': r[0], 'name': r[1], 'size': r[2], 'mtime': r[3], 'snippet': r[4]} for r in rows[:limit]], len(rows) > limit
+
+    def dir_stats(self, rel_paths):
+        """{目录: (递归大小, 文件数)}；没有文件的目录不在结果中 (即 0)"""
+        paths = list(dict.fromkeys(map(self.norm, rel_paths))); res = {}
+        conn = self._conn()
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            for path, size, files in conn.execute(f"SELECT path, size, files FROM dirs WHERE path IN ({','.join('?' * len(chunk))})", chunk):
+                res[path] = (size, files)
+        return res
+
+    def dir_stat(self, rel_path):
+        return self.dir_stats([rel_path]).get(self.norm(rel_path), (0, 0))
+
+    @property
+    def ready(self):
+        return self._meta('reconciled_at') > 0
+
+    # --- 全量对账 ---
+    def reconcile(self, lease=None, renew_every=LEASE_RENEW):
+        """
+        全量遍历存储目录：只写入新增或大小/修改时间变化的文件，再分批清除已不存在的记录；目录聚合由触发器增量维护
+        遍历到的路径记在连接私有的临时表中 (不占用主库的写锁)；清除时只删除本轮未遍历到、且 gen 早于本轮的记录
+        (对账期间 upsert_path / move_path 写入的记录带有本轮 gen，不会被误删)，每批一个短事务
+        lease 为 _claim('reconcile_claim') 的返回值：定期续租，租约被其他进程接管或其他轮次已开始时放弃本轮 (已清除的批次保留)
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'gen'")
+            gen = int(self._meta('gen')) # 同一事务内读取，不会读到其他进程的递增
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY) WITHOUT ROWID')
+        renewed = time.monotonic()
+        try:
+            with scan_timer('index_reconcile'):
+                batch = []
+                for row in self._scan(''):
+                    batch.append(row)
+                    if len(batch) >= self.BATCH_SIZE: self._reconcile_batch(conn, batch, gen); batch = []
+                    if lease is not None and time.monotonic() - renewed >= renew_every:
+                        lease = self._renew('reconcile_claim', lease)
+                        if lease is None: return False
+                        renewed = time.monotonic()
+                self._reconcile_batch(conn, batch, gen)
+                last = ''
+                while True:
+                    rows = conn.execute('''SELECT f.path, s.path IS NULL AND f.gen < ? FROM files f LEFT JOIN temp.seen s ON s.path = f.path
+                                           WHERE f.path > ? ORDER BY f.path LIMIT ?''', (gen, last, self.BATCH_SIZE)).fetchall()
+                    if not rows: break
+                    last = rows[-1][0]
+                    gone = [(p, gen) for p, missing in rows if missing]
+                    if not gone: continue
+                    with conn:
+                        conn.execute('BEGIN IMMEDIATE')
+                        if lease is not None:
+                            lease = self._renew('reconcile_claim', lease)
+                            if lease is None or int(self._meta('gen')) != gen: return False
+                        conn.executemany('DELETE FROM files WHERE path = ? AND gen < ?', gone)
+                    renewed = time.monotonic()
+            with conn:
+                conn.execute('DELETE FROM dirs WHERE files <= 0') # 已清空的目录
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'reconciled_at'", (time.time(),))
+        finally:
+            with conn: conn.execute('DELETE FROM temp.seen')
+        self._content_event.set()
+        return True
+
+    def _reconcile_batch(self, conn, rows, gen):
+        # 记录已遍历的路径；与索引中的大小/修改时间比较，只写入有变化的行
+        if not rows: return
+        with conn: conn.executemany('INSERT OR IGNORE INTO temp.seen (path) VALUES (?)', [(r[0],) for r in rows])
+        known = {}
+        for i in range(0, len(rows), 500):
+            chunk = [r[0] for r in rows[i:i + 500]]
+            known.update((p, (size, mtime)) for p, size, mtime in conn.execute(f"SELECT path, size, mtime FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk))
+        changed = [r for r in rows if known.get(r[0]) != (r[4], r[5])]
+        if changed:
+            with conn: self._upsert_rows(conn, changed, gen)
+
+    def _claim(self, key, interval):
+        # 多个 gunicorn worker 共享同一个库，用条件 UPDATE 抢占，只有一个进程会执行
+        # 返回写入的时间戳 (租约凭据，供 _renew 续租)，未抢到时返回 None；持有者停止续租 interval 秒后其他进程才能接管
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            cur = conn.execute("UPDATE meta SET value = ? WHERE key = ? AND value < ?", (now, key, now - interval))
+        return now if cur.rowcount == 1 else None
+
+    def _renew(self, key, lease):
+        """续租：时间戳仍是自己写入的才更新，返回新的凭据；已被其他进程接管时返回 None (可在调用方的事务中执行)"""
+        now = time.time()
+        conn = self._conn()
+        if conn.in_transaction: cur = conn.execute("UPDATE meta SET value = ? WHERE key = ? AND value = ?", (now, key, lease))
+        else:
+            with conn: cur = conn.execute("UPDATE meta SET value = ? WHERE key = ? AND value = ?", (now, key, lease))
+        return now if cur.rowcount == 1 else None
+
+    def _claim_reconcile(self, interval):
+        return self._claim('reconcile_claim', interval)
+
+    # --- 文本内容索引 (可选) ---
+    def index_contents(self, exts, max_bytes):
+        """为内容有变化的文本文件 (mtime 与上次索引时不同) 更新内容索引，返回本批处理数量"""
+        conn = self._conn()
+        rows = conn.execute(f"SELECT rowid, path, mtime FROM files WHERE content_mtime IS NOT mtime AND ext IN ({','.join('?' * len(exts))}) LIMIT ?",
+                            list(exts) + [self.CONTENT_BATCH]).fetchall()
+        for rowid, rel_path, mtime in rows:
+            try:
+                with open(os.path.join(self.root_dir, rel_path), 'rb') as f: body = f.read(max_bytes).decode('utf-8', 'ignore')
+            except OSError: body = ''
+            with conn:
+                conn.execute('DELETE FROM content_fts WHERE rowid = ?', (rowid,))
+                if body: conn.execute('INSERT INTO content_fts (rowid, body) VALUES (?, ?)', (rowid, body))
+                conn.execute('UPDATE files SET content_mtime = ? WHERE rowid = ? AND mtime = ?', (mtime, rowid, mtime))
+        return len(rows)
+
+    def start_content_indexer(self, exts, max_bytes, interval=60):
+        """后台线程：写操作 (upsert_path) 后尽快、否则每 interval 秒处理一次待索引文件"""
+        exts = tuple(exts)
+        def loop():
+            while True:
+                self._content_event.wait(interval); self._content_event.clear()
+                try:
+                    while self._claim('content_claim', 5) and self.index_contents(exts, max_bytes) == self.CONTENT_BATCH: pass
+                except Exception: pass
+        threading.Thread(target=loop, name='file-index-content', daemon=True).start()
+
+    def start_reconciler(self, interval):
+        def loop():
+            while True:
+                try:
+                    lease = self._claim_reconcile(interval)
+                    if lease: self.reconcile(lease, min(self.LEASE_RENEW, interval / 3))
+                except Exception: pass
+                time.sleep(min(interval, 60))
+        threading.Thread(target=loop, name='file-index-reconciler', daemon=True).start()
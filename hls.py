@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import mimetypes
+import subprocess
+from metrics import scan_timer
+
+MASTER = 'master.m3u8'
+PENDING_SUFFIX = '.pending'
+PENDING_TIMEOUT = 600 # 构建中的标记超过该时间没有更新 (worker 退出)，或失败记录超过该时间，允许重新提交
+PROGRESS_INTERVAL = 2
+TOUCH_INTERVAL = 3600 # 命中后最多每小时刷新一次 master.m3u8 的 mtime，作为 LRU 淘汰依据
+AUDIO_BITRATE = 128 # kbps
+REMUX_VIDEO_CODECS = {'h264'}
+REMUX_AUDIO_CODECS = {'aac', 'mp3'}
+KEY_RE = re.compile(r'^[0-9a-f]{40}$')
+SEGMENT_NAME_RE = re.compile(r'^(master\.m3u8|v\d+/(index\.m3u8|seg_\d+\.ts))$')
+
+mimetypes.add_type('video/mp2t', '.ts') # 默认会识别成 Qt 翻译文件
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+
+
+def parse_variants(spec):
+    """'720:2800,480:1400' -> [(720, 2800), (480, 1400)] (高度, 视频码率 kbps)，按高度降序"""
+    res = []
+    for item in filter(None, (s.strip() for s in spec.split(','))):
+        height, kbps = item.split(':')
+        res.append((int(height), int(kbps)))
+    return sorted(res, reverse=True)
+
+
+class HlsCache:
+    """
+    视频转 HLS 的磁盘缓存：目录名为 sha1(相对路径 + mtime + 大小)，源文件一改动自然失效
+    每个视频一个目录：master.m3u8 + v0/, v1/ ... (各码率的 index.m3u8 与 6 秒左右的 TS 分片)
+    H.264 + AAC/MP3 的源文件直接转封装 (不重新编码，画质不变) 作为最高一档，其余档位用 libx264 转码
+    构建在 Celery worker 中进行 (tasks.hls_task)：先写到临时目录，全部完成后整体 rename，读者不会看到半成品
+    """
+    def __init__(self, cache_dir, max_bytes, variants, segment_seconds=6, ffmpeg='ffmpeg', ffprobe='ffprobe'):
+        self.cache_dir, self.max_bytes, self.variants, self.segment_seconds = cache_dir, max_bytes, variants, segment_seconds
+        self.ffmpeg, self.ffprobe = ffmpeg, ffprobe
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def available(self):
+        return bool(shutil.which(self.ffmpeg) and shutil.which(self.ffprobe))
+
+    def output_dir(self, rel_path, mtime, file_size):
+        # mtime 取毫秒整数，与缩略图缓存的键一致
+        key = hashlib.sha1(f"{rel_path}\0{int(mtime * 1000)}\0{file_size}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _out(self, abs_path, rel_path):
+        st = os.stat(abs_path)
+        return self.output_dir(rel_path, st.st_mtime, st.st_size)
+
+    # --- 状态 ---
+    def _read_pending(self, out_dir):
+        try:
+            with open(out_dir + PENDING_SUFFIX) as f: pending = json.load(f)
+        except (OSError, ValueError): return None
+        return pending if time.time() - pending.get('updated_at', 0) < PENDING_TIMEOUT else None
+
+    def _write_pending(self, out_dir, pending):
+        tmp = f"{out_dir}{PENDING_SUFFIX}.{uuid.uuid4().hex}"
+        with open(tmp, 'w') as f: json.dump({**pending, 'updated_at': time.time()}, f)
+        os.replace(tmp, out_dir + PENDING_SUFFIX)
+
+    def status(self, abs_path, rel_path):
+        """返回 ('ready', 输出目录) / ('pending', 构建进度) / ('failed', 失败记录) / ('missing', None)"""
+        out_dir = self._out(abs_path, rel_path)
+        master = os.path.join(out_dir, MASTER)
+        try:
+            if time.time() - os.stat(master).st_mtime > TOUCH_INTERVAL: os.utime(master)
+            return 'ready', out_dir
+        except FileNotFoundError: pass
+        pending = self._read_pending(out_dir)
+        if not pending: return 'missing', None
+        return ('failed' if pending.get('error') else 'pending'), pending
+
+    def claim(self, abs_path, rel_path, task_id):
+        """登记构建任务；已有进行中的构建时返回 False (多个 worker 同时请求只会提交一次)"""
+        out_dir = self._out(abs_path, rel_path)
+        os.makedirs(os.path.dirname(out_dir), exist_ok=True)
+        marker = out_dir + PENDING_SUFFIX
+        try: fd = os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            if self._read_pending(out_dir): return False
+            self._write_pending(out_dir, {'task_id': task_id, 'percent': 0}) # 上一次构建已中断，接管
+            return True
+        with os.fdopen(fd, 'w') as f: json.dump({'task_id': task_id, 'percent': 0, 'updated_at': time.time()}, f)
+        return True
+
+    def file_path(self, key, name):
+        """播放列表/分片的绝对路径 (key 为输出目录名)；不合法时返回 None"""
+        if not KEY_RE.match(key) or not SEGMENT_NAME_RE.match(name): return None
+        return os.path.join(self.cache_dir, key[:2], key, name)
+
+    # --- 构建 ---
+    def probe(self, abs_path):
+        out = subprocess.run([self.ffprobe, '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', abs_path],
+                             capture_output=True, check=True).stdout
+        info = json.loads(out)
+        video = next((s for s in info.get('streams', []) if s.get('codec_type') == 'video' and not s.get('disposition', {}).get('attached_pic')), None)
+        if not video: raise ValueError('No video stream')
+        audio = next((s for s in info.get('streams', []) if s.get('codec_type') == 'audio'), None)
+        fmt = info.get('format', {}); duration = float(fmt.get('duration') or 0)
+        return {'width': int(video.get('width') or 0), 'height': int(video.get('height') or 0), 'vcodec': video.get('codec_name'),
+                'acodec': audio.get('codec_name') if audio else None, 'duration': duration,
+                'bitrate': int(fmt.get('bit_rate') or 0) or (int(os.path.getsize(abs_path) * 8 / duration) if duration else 0)}
+
+    def plan(self, info):
+        """档位列表 [(模式, 高度, 视频码率 kbps)]；模式为 'copy' (转封装) 或 'x264'"""
+        copy = info['vcodec'] in REMUX_VIDEO_CODECS and (info['acodec'] is None or info['acodec'] in REMUX_AUDIO_CODECS)
+        height = info['height']
+        if copy: ladder = [(h, b) for h, b in self.variants if h < height]
+        else: ladder = [(h, b) for h, b in self.variants if h <= height] or [(height, self.variants[-1][1])]
+        return ([('copy', height, info['bitrate'] // 1000)] if copy else []) + [('x264', h, b) for h, b in ladder]
+
+    def _command(self, abs_path, vdir, mode, height, kbps, has_audio):
+        cmd = [self.ffmpeg, '-nostdin', '-v', 'error', '-y', '-i', abs_path, '-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn']
+        if mode == 'copy': cmd += ['-c', 'copy']
+        else:
+            # 关键帧按分片时长对齐，各档位的分片边界一致，切换码率时不会跳帧
+            cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main', '-pix_fmt', 'yuv420p', '-vf', f'scale=-2:{height}',
+                    '-b:v', f'{kbps}k', '-maxrate', f'{kbps * 107 // 100}k', '-bufsize', f'{kbps * 2}k',
+                    '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_seconds})']
+            if has_audio: cmd += ['-c:a', 'aac', '-b:a', f'{AUDIO_BITRATE}k', '-ac', '2']
+        return cmd + ['-f', 'hls', '-hls_time', str(self.segment_seconds), '-hls_playlist_type', 'vod',
+                      '-hls_segment_filename', os.path.join(vdir, 'seg_%05d.ts'), '-progress', 'pipe:1', os.path.join(vdir, 'index.m3u8')]
+
+    def _run(self, cmd, log_path, on_time):
+        """执行 ffmpeg；-progress 输出的 out_time_us 用于计算进度"""
+        with open(log_path, 'wb') as log:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log)
+            for line in proc.stdout:
+                if line.startswith(b'out_time_us='):
+                    try: on_time(int(line[12:]) / 1e6)
+                    except ValueError: pass
+            proc.wait()
+        if proc.returncode != 0:
+            with open(log_path, 'rb') as f: error = f.read().decode('utf-8', 'replace').strip().splitlines()
+            raise RuntimeError(f"ffmpeg failed: {error[-1] if error else proc.returncode}")
+
+    def build(self, abs_path, rel_path, task_id=None):
+        """生成全部档位与 master.m3u8，返回输出目录；进度写入构建标记 (status() 读取)"""
+        out_dir = self._out(abs_path, rel_path)
+        if os.path.exists(os.path.join(out_dir, MASTER)): return out_dir
+        tmp = f"{out_dir}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp)
+        try:
+            info = self.probe(abs_path)
+            variants = self.plan(info)
+            last = [0]
+            for i, (mode, height, kbps) in enumerate(variants):
+                vdir = os.path.join(tmp, f'v{i}'); os.makedirs(vdir)
+                def on_time(t, i=i):
+                    if time.monotonic() - last[0] < PROGRESS_INTERVAL: return
+                    last[0] = time.monotonic()
+                    done = min(t / info['duration'], 1) if info['duration'] else 0
+                    self._write_pending(out_dir, {'task_id': task_id, 'percent': int((i + done) * 100 / len(variants)), 'variant': f'{height}p'})
+                self._run(self._command(abs_path, vdir, mode, height, kbps, info['acodec'] is not None), os.path.join(tmp, f'v{i}.log'), on_time)
+                os.remove(os.path.join(tmp, f'v{i}.log'))
+            with open(os.path.join(tmp, MASTER), 'w') as f: f.write(self.master_playlist(info, variants))
+            try: os.rename(tmp, out_dir)
+            except OSError: shutil.rmtree(tmp, ignore_errors=True) # 另一个 worker 已先完成
+        except BaseException as e:
+            # 失败记录保留 PENDING_TIMEOUT 秒，期间不会被反复提交
+            shutil.rmtree(tmp, ignore_errors=True)
+            self._write_pending(out_dir, {'task_id': task_id, 'error': str(e) or type(e).__name__})
+            raise
+        try: os.remove(out_dir + PENDING_SUFFIX)
+        except OSError: pass
+        return out_dir
+
+    def master_playlist(self, info, variants):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+        for i, (mode, height, kbps) in enumerate(variants):
+            width = info['width'] if mode == 'copy' else round(info['width'] * height / info['height'] / 2) * 2
+            bandwidth = (kbps or 1000) * 1000 if mode == 'copy' else (kbps + AUDIO_BITRATE) * 1000
+            lines += [f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}', f'v{i}/index.m3u8']
+        return '\n'.join(lines) + '\n'
+
+    # --- 淘汰 ---
+    def evict(self):
+        """总量超过 max_bytes 时按 master.m3u8 的 mtime 淘汰最久未播放的视频；顺带清理中断的临时目录与过期的构建标记"""
+        entries, total, now = [], 0, time.time()
+        with scan_timer('hls_evict'):
+            for prefix in os.listdir(self.cache_dir):
+                pdir = os.path.join(self.cache_dir, prefix)
+                if not os.path.isdir(pdir): continue
+                for name in os.listdir(pdir):
+                    path = os.path.join(pdir, name)
+                    if '.tmp-' in name:
+                        try:
+                            if now - os.stat(path).st_mtime > PENDING_TIMEOUT and not self._read_pending(path.split('.tmp-')[0]): shutil.rmtree(path, ignore_errors=True)
+                        except OSError: pass
+                        continue
+                    if name.endswith(PENDING_SUFFIX):
+                        if not self._read_pending(path[:-len(PENDING_SUFFIX)]):
+                            try: os.remove(path)
+                            except OSError: pass
+                        continue
+                    if not os.path.isdir(path): continue
+                    size = 0
+                    for root, dirs, files in os.walk(path):
+                        for f in files:
+                            try: size += os.stat(os.path.join(root, f)).st_size
+                            except OSError: pass
+                    try: mtime = os.stat(os.path.join(path, MASTER)).st_mtime
+                    except OSError: mtime = 0
+                    entries.append((mtime, size, path)); total += size
+        if total <= self.max_bytes: return
+        target = self.max_bytes * 0.9
+        for mtime, size, path in sorted(entries):
+            shutil.rmtree(path, ignore_errors=True); total -= size
+            if total <= target: break
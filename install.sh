@@ -107,10 +107,12 @@ services:
       - STORAGE_PATH=/app/storage
       - TRASH_PATH=/app/trash
       - SHARE_PATH=/app/shares
+      - META_PATH=/app/meta
     volumes:
       - ./data/storage:/app/storage
       - ./data/trash:/app/trash
       - ./data/shares:/app/shares
+      - ./data/meta:/app/meta
     depends_on:
       - redis
   redis:
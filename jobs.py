@@ -0,0 +1,154 @@
+import os
+import time
+import uuid
+import errno
+import shutil
+from metrics import scan_timer
+
+PROGRESS_INTERVAL = 0.5
+COPY_BUFSIZE = 8 * 1024 * 1024
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobProgress:
+    """
+    后台文件任务的字节级进度：items 为用户选中的条目数，bytes 为需要实际读写/删除的字节数 (同盘重命名不计)
+    report(state) 最多每 interval 秒调用一次，返回 True 表示用户已请求取消，此后的 advance 抛出 JobCancelled
+    """
+    def __init__(self, report, interval=PROGRESS_INTERVAL):
+        self.report, self.interval = report, interval
+        self.items_total = self.items_done = self.bytes_total = self.bytes_done = 0
+        self.current, self.cancelled, self._last = '', False, 0
+
+    def state(self):
+        percent = self.bytes_done * 100 // self.bytes_total if self.bytes_total else (self.items_done * 100 // self.items_total if self.items_total else 0)
+        return {'items_done': self.items_done, 'items_total': self.items_total, 'bytes_done': self.bytes_done,
+                'bytes_total': self.bytes_total, 'percent': min(percent, 100), 'current': self.current}
+
+    def flush(self):
+        self._last = time.monotonic()
+        if self.report(self.state()): self.cancelled = True
+
+    def advance(self, nbytes=0, current=None):
+        self.bytes_done += nbytes
+        if current is not None: self.current = current
+        if time.monotonic() - self._last >= self.interval: self.flush()
+        if self.cancelled: raise JobCancelled()
+
+    def item_done(self):
+        self.items_done += 1; self.advance()
+
+    def heartbeat(self):
+        """长时间不产生进度的阶段 (统计目录大小) 中定期调用：按 interval 上报当前状态 (兼作心跳)，已请求取消时抛出 JobCancelled"""
+        self.advance()
+
+
+def tree_size(path, progress=None):
+    """(文件数, 字节数)，不跟随符号链接；progress 不为空时遍历期间持续发送心跳 (大目录可能需要数分钟)"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        return 1, os.lstat(path).st_size
+    files = size = 0
+    with scan_timer('job_plan'):
+        for root, dirs, names in os.walk(path):
+            for name in names:
+                try: size += os.lstat(os.path.join(root, name)).st_size; files += 1
+                except OSError: pass
+                if progress: progress.heartbeat()
+    return files, size
+
+
+def volume_of(path):
+    """路径所在文件系统 (st_dev)；路径尚不存在时取最近的已存在上级目录"""
+    while True:
+        try: return os.stat(path).st_dev
+        except FileNotFoundError:
+            parent = os.path.dirname(path)
+            if parent == path: raise
+            path = parent
+
+
+def is_within(path, parent):
+    """path 是否为 parent 本身或位于其下 (按真实路径比较)"""
+    path, parent = os.path.realpath(path), os.path.realpath(parent)
+    return os.path.commonpath([path, parent]) == parent
+
+
+def copy_file(src, dst, progress, tmp_suffix='.part'):
+    """复制单个文件：优先 copy_file_range (内核内拷贝)，写入隐藏临时文件后原子替换，失败/取消时清理临时文件"""
+    tmp = os.path.join(os.path.dirname(dst), f".{uuid.uuid4().hex}.{os.path.basename(dst)}{tmp_suffix}")
+    name = os.path.basename(src)
+    try:
+        with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            use_range = hasattr(os, 'copy_file_range')
+            while True:
+                if use_range:
+                    try: n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_BUFSIZE)
+                    except OSError: use_range = False; continue # 跨文件系统或内核不支持，改用普通读写 (双方偏移量均已同步推进)
+                else:
+                    buf = fsrc.read(COPY_BUFSIZE); n = len(buf)
+                    if n: fdst.write(buf)
+                if not n: break
+                progress.advance(n, name)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+
+
+def copy_tree(src, dst, progress, copy_file=copy_file, skip_suffixes=()):
+    """
+    与 shutil.copytree / copy2 相同的语义 (目标目录已存在时报错)；取消或出错时删除已复制的部分
+    skip_suffixes: 不复制的文件后缀 (如进行中的分片上传 .part 文件，文件索引与去重都会忽略它们)
+    """
+    if not os.path.isdir(src):
+        return copy_file(src, dst, progress)
+    # 目标位于源目录内时 os.walk 会不断进入新建的副本
+    if is_within(dst, src): raise ValueError('Cannot copy a folder into itself')
+    os.makedirs(dst)
+    try:
+        for root, dirs, files in os.walk(src):
+            target = os.path.join(dst, os.path.relpath(root, src))
+            for d in dirs: os.makedirs(os.path.join(target, d), exist_ok=True)
+            for name in files:
+                if skip_suffixes and name.endswith(skip_suffixes): continue
+                copy_file(os.path.join(root, name), os.path.join(target, name), progress)
+        for root, dirs, files in os.walk(src, topdown=False):
+            shutil.copystat(root, os.path.join(dst, os.path.relpath(root, src)))
+    except BaseException:
+        remove_tree(dst); raise
+
+
+def remove_tree(path, progress=None):
+    """逐个删除文件 (progress 按释放的字节计数，可在文件之间取消)"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        size = os.lstat(path).st_size; os.remove(path)
+        if progress: progress.advance(size, os.path.basename(path))
+        return
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            p = os.path.join(root, name)
+            try: size = os.lstat(p).st_size
+            except OSError: continue
+            os.remove(p)
+            if progress: progress.advance(size, name)
+        for name in dirs:
+            p = os.path.join(root, name)
+            os.remove(p) if os.path.islink(p) else os.rmdir(p)
+    os.rmdir(path)
+
+
+def move_path(src, dst, progress, copy_file=copy_file):
+    """同一文件系统直接 rename；跨文件系统先带进度复制再删除源 (复制阶段取消不会留下半成品)"""
+    if os.path.isdir(src) and is_within(dst, src): raise ValueError('Cannot move a folder into itself')
+    try:
+        os.rename(src, dst); return False
+    except OSError as e:
+        if e.errno != errno.EXDEV: raise
+    copy_tree(src, dst, progress, copy_file)
+    remove_tree(src)
+    return True
@@ -0,0 +1,86 @@
+import os
+import time
+import sqlite3
+import threading
+
+NEVER = 100 * 365 * 86400 # 永不过期的条目也登记 (到期时间 = 创建时间 + NEVER)，存储压力淘汰时跳过这些条目
+
+
+class ExpiryIndex:
+    """
+    到期时间索引：(kind, key) -> expires_at，expires_at 上有索引
+    清理任务只取已到期的条目 (按到期时间顺序分批)，不遍历目录，也不扫描各元数据库
+    kind: 'share' (分享链接) / 'archive' (打包结果文件，key 为相对存储根目录的路径) / 'trash' (回收站条目)
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS expiry (
+                kind TEXT NOT NULL, key TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_expiry_at ON expiry (expires_at);
+            CREATE INDEX IF NOT EXISTS idx_expiry_kind_at ON expiry (kind, expires_at);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def set(self, kind, key, expires_at):
+        self.set_many(kind, {key: expires_at})
+
+    def set_many(self, kind, items, replace=True):
+        """replace=False 时不覆盖已登记的条目 (补登旧数据用)"""
+        if not items: return
+        conn = self._conn()
+        with conn: conn.executemany(f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO expiry (kind, key, expires_at) VALUES (?, ?, ?)", [(kind, k, v) for k, v in items.items()])
+
+    def remove(self, kind, keys):
+        if not keys: return
+        conn = self._conn()
+        with conn: conn.executemany('DELETE FROM expiry WHERE kind = ? AND key = ?', [(kind, k) for k in keys])
+
+    def contains(self, kind, key):
+        return self._conn().execute('SELECT 1 FROM expiry WHERE kind = ? AND key = ?', (kind, key)).fetchone() is not None
+
+    def due(self, now, limit=500):
+        """已到期的 [(kind, key)]，最早到期的在前"""
+        return self._conn().execute('SELECT kind, key FROM expiry WHERE expires_at <= ? ORDER BY expires_at LIMIT ?', (now, limit)).fetchall()
+
+    def earliest(self, kind, limit=100, before=None):
+        """某类条目中最早到期的 [key] (存储压力淘汰用)；before 不为空时只取在此之前到期的"""
+        return [r[0] for r in self._conn().execute('SELECT key FROM expiry WHERE kind = ? AND expires_at < ? ORDER BY expires_at LIMIT ?',
+                                                   (kind, float('inf') if before is None else before, limit))]
+
+    def stats(self, now):
+        """{kind: {'total', 'due', 'next_expiry'}} (永不过期的条目不计入 next_expiry)"""
+        res = {}
+        for kind, total, due, nxt in self._conn().execute('''SELECT kind, COUNT(*), SUM(expires_at <= ?), MIN(CASE WHEN expires_at > ? AND expires_at < ? THEN expires_at END)
+                                                              FROM expiry GROUP BY kind''', (now, now, now + NEVER / 2)):
+            res[kind] = {'total': total, 'due': due or 0, 'next_expiry': nxt}
+        return res
+
+    # --- 元数据：一次性回填标记、清理任务抢占 ---
+    def flag(self, key):
+        row = self._conn().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def set_flag(self, key, value=1):
+        conn = self._conn()
+        with conn: conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def claim(self, key, interval):
+        """条件 UPDATE 抢占：beat 重复触发或多个 worker 同时执行时，interval 秒内只有一个会真正清理"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, 0)', (key,))
+            cur = conn.execute('UPDATE meta SET value = ? WHERE key = ? AND value < ?', (now, key, now - interval))
+        return cur.rowcount == 1
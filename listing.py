@@ -0,0 +1,80 @@
+import os
+import time
+import json
+import base64
+import threading
+from collections import OrderedDict
+from metrics import scan_timer
+
+SORT_KEYS = {
+    'name': lambda e: e[0].lower(),
+    'mtime': lambda e: e[3],
+    'size': lambda e: e[2],
+}
+
+
+class DirListingCache:
+    """
+    目录列表缓存 (进程内 LRU)：条目为 (name, is_dir, size, mtime)
+    目录 mtime 变化 (增/删/改名) 立即失效；本服务原地覆盖文件后调用 invalidate (同时更新目录 mtime，其他 worker 的缓存随之失效)；
+    其他程序直接修改文件内容不会改目录 mtime，由 ttl 兜底
+    """
+    def __init__(self, max_dirs=256, ttl=60, ignore_suffixes=()):
+        self.max_dirs, self.ttl, self.ignore_suffixes = max_dirs, ttl, tuple(ignore_suffixes)
+        self._cache, self._lock = OrderedDict(), threading.Lock()
+
+    def _scan(self, abs_path):
+        entries = []
+        with os.scandir(abs_path) as it:
+            for entry in it:
+                if self.ignore_suffixes and entry.name.endswith(self.ignore_suffixes): continue
+                try:
+                    st = entry.stat(); is_dir = entry.is_dir()
+                except OSError: continue
+                entries.append((entry.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime))
+        return entries
+
+    def get(self, abs_path):
+        version = os.stat(abs_path).st_mtime_ns
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(abs_path)
+            if hit and hit['version'] == version and now - hit['at'] < self.ttl:
+                self._cache.move_to_end(abs_path); return hit
+        with scan_timer('listing'): entries = self._scan(abs_path)
+        hit = {'version': version, 'at': now, 'entries': entries, 'sorted': {}}
+        with self._lock:
+            self._cache[abs_path] = hit
+            if len(self._cache) > self.max_dirs: self._cache.popitem(last=False)
+        return hit
+
+    def invalidate(self, abs_path):
+        """清除本进程的缓存，并把目录 mtime 更新为当前时间：缓存按目录 mtime 校验，gunicorn 其他 worker 的缓存也会失效"""
+        with self._lock: self._cache.pop(abs_path, None)
+        try: os.utime(abs_path)
+        except OSError: pass
+
+    @staticmethod
+    def sorted_entries(hit, sort, order):
+        # 排序结果随缓存一起保存；文件夹始终排在文件前面
+        key = (sort, order)
+        if key not in hit['sorted']:
+            fn = SORT_KEYS.get(sort, SORT_KEYS['name']); desc = order == 'desc'
+            dirs = sorted((e for e in hit['entries'] if e[1]), key=fn, reverse=desc)
+            files = sorted((e for e in hit['entries'] if not e[1]), key=fn, reverse=desc)
+            hit['sorted'][key] = dirs + files
+        return hit['sorted'][key]
+
+
+def encode_cursor(version, offset, last_name):
+    return base64.urlsafe_b64encode(json.dumps([version, offset, last_name], ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+
+def resolve_cursor(cursor, version, names):
+    """游标 -> 起始下标：快照未变时直接用偏移量，目录已变化则按上一页最后一个文件名重新定位"""
+    if not cursor: return 0
+    try: v, offset, last_name = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError): return 0
+    if v == version: return offset
+    try: return names.index(last_name) + 1
+    except ValueError: return min(offset, len(names))
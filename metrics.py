@@ -0,0 +1,67 @@
+import os
+import time
+from functools import wraps
+from contextlib import contextmanager
+
+# 设置了 PROMETHEUS_MULTIPROC_DIR 时 (start.sh 中启动前清空该目录)，各 gunicorn worker 与 Celery worker
+# 把指标写入该目录下的 mmap 文件，/metrics 汇总全部进程；未设置时只统计当前进程 (开发模式)
+try:
+    from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client import multiprocess
+except ImportError: # 未安装 prometheus_client 时所有指标为空操作，/metrics 返回 404
+    Counter = Histogram = None
+
+ENABLED = Counter is not None
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+SCAN_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+META_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+class _Noop:
+    def labels(self, *args, **kwargs): return self
+    def observe(self, value): pass
+    def inc(self, amount=1): pass
+
+
+def _metric(cls, *args, **kwargs):
+    return cls(*args, **kwargs) if ENABLED else _Noop()
+
+
+REQUEST_SECONDS = _metric(Histogram, 'http_request_duration_seconds', '请求处理耗时 (流式响应为首字节时间)', ['method', 'endpoint', 'status'])
+SHARE_BYTES = _metric(Counter, 'share_bytes_served_total', '分享链接 (/s、/img) 发送的字节数', ['share_id'])
+SHARE_REQUESTS = _metric(Counter, 'share_requests_total', '分享链接请求数', ['share_id', 'status'])
+META_SECONDS = _metric(Histogram, 'metadata_operation_seconds', '元数据库 (JsonManager) 读写耗时', ['store', 'op'], buckets=META_BUCKETS)
+TASK_SECONDS = _metric(Histogram, 'celery_task_duration_seconds', 'Celery 任务执行耗时', ['task', 'state'], buckets=TASK_BUCKETS)
+SCAN_SECONDS = _metric(Histogram, 'fs_scan_duration_seconds', '目录遍历耗时', ['scan'], buckets=SCAN_BUCKETS)
+
+
+@contextmanager
+def timer(metric, **labels):
+    start = time.perf_counter()
+    try: yield
+    finally: metric.labels(**labels).observe(time.perf_counter() - start)
+
+
+def scan_timer(name):
+    return timer(SCAN_SECONDS, scan=name)
+
+
+def timed_method(op):
+    """JsonManager 方法计时：store 取子类名 (TrashManager / ShareManager ...)"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with timer(META_SECONDS, store=type(self).__name__, op=op): return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render():
+    """返回 (body, content_type)；多进程模式下每次抓取都从 mmap 文件汇总"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else: registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
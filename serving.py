@@ -0,0 +1,135 @@
+import os
+import uuid
+import mimetypes
+import unicodedata
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import Response, request
+from werkzeug.http import parse_range_header, parse_if_range_header, parse_etags, parse_date
+
+CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 32 # 超过则按整文件返回，防止构造大量小区间拖垮服务
+
+
+def _content_disposition(disposition, name):
+    try:
+        name.encode('ascii')
+        return f'{disposition}; filename="{name}"'
+    except UnicodeEncodeError:
+        ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii') or 'download'
+        return f"{disposition}; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+
+def _iter_file(f, start, length):
+    f.seek(start)
+    while length > 0:
+        data = f.read(min(CHUNK_SIZE, length))
+        if not data: break
+        length -= len(data); yield data
+
+
+def _file_body(f, start, length):
+    # gunicorn 提供 wsgi.file_wrapper：从当前偏移 sendfile()，长度以 Content-Length 为准，数据不经过 Python
+    # 开发服务器没有该扩展，只能分块读取
+    wrapper = request.environ.get('wsgi.file_wrapper')
+    if wrapper:
+        f.seek(start)
+        return wrapper(f, CHUNK_SIZE)
+    return _close_after(_iter_file(f, start, length), f)
+
+
+def _close_after(iterable, f):
+    try: yield from iterable
+    finally: f.close()
+
+
+def _multipart_body(abs_path, parts, trailer):
+    with open(abs_path, 'rb') as f:
+        for head, start, stop in parts:
+            yield head
+            yield from _iter_file(f, start, stop - start)
+            yield b'\r\n'
+    yield trailer
+
+
+def multipart_parts(ranges, size, content_type):
+    """多区间响应的分段: ([(分段头, start, stop)], 结尾, boundary, 总长度)"""
+    boundary = uuid.uuid4().hex
+    parts = [(f"--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {a}-{b - 1}/{size}\r\n\r\n".encode(), a, b) for a, b in ranges]
+    trailer = f"--{boundary}--\r\n".encode()
+    return parts, trailer, boundary, sum(len(h) + (b - a) + 2 for h, a, b in parts) + len(trailer)
+
+
+def _resolve_ranges(req_headers, size, etag, mtime):
+    """返回 None (整文件) / [] (无法满足, 416) / [(start, stop), ...]"""
+    rng = parse_range_header(req_headers.get('Range'))
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) > MAX_RANGES: return None
+    if_range = parse_if_range_header(req_headers.get('If-Range'))
+    if if_range.etag is not None and if_range.etag != etag.strip('"'): return None
+    if if_range.date is not None and int(mtime) > if_range.date.timestamp(): return None
+    res = []
+    for begin, end in rng.ranges:
+        start, stop = (max(size + begin, 0), size) if begin < 0 else (begin, min(end, size) if end is not None else size)
+        if start < size and start < stop: res.append((start, stop))
+    return res
+
+
+def evaluate(abs_path, req_headers, download_name=None, as_attachment=False, cache_control='no-cache'):
+    """
+    与框架无关的部分 (Flask 与异步模式 asgi.py 共用)：stat、响应头、条件请求 (304) 与 Range 判定 (416/206)
+    req_headers 为支持 .get(名称) 的请求头映射；返回 (status, headers, ranges, size, content_type)
+    """
+    st = os.stat(abs_path)
+    size, mtime = st.st_size, st.st_mtime
+    etag = f'"{st.st_ino:x}-{size:x}-{st.st_mtime_ns:x}"'
+    name = download_name or os.path.basename(abs_path)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': etag, 'Accept-Ranges': 'bytes', 'Cache-Control': cache_control,
+        'Last-Modified': datetime.fromtimestamp(int(mtime), timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        'Content-Disposition': _content_disposition('attachment' if as_attachment else 'inline', name),
+    }
+
+    # 条件请求：If-None-Match 优先于 If-Modified-Since
+    if_none_match = parse_etags(req_headers.get('If-None-Match'))
+    if_modified_since = parse_date(req_headers.get('If-Modified-Since'))
+    if if_none_match:
+        if if_none_match.contains_weak(etag.strip('"')): return 304, headers, None, size, content_type
+    elif if_modified_since and int(mtime) <= if_modified_since.timestamp():
+        return 304, headers, None, size, content_type
+
+    ranges = _resolve_ranges(req_headers, size, etag, mtime)
+    if ranges == []:
+        headers['Content-Range'] = f'bytes */{size}'
+        return 416, headers, ranges, size, content_type
+    if ranges and len(ranges) == 1: headers['Content-Range'] = f'bytes {ranges[0][0]}-{ranges[0][1] - 1}/{size}'
+    return (200 if ranges is None else 206), headers, ranges, size, content_type
+
+
+def serve_file(abs_path, download_name=None, as_attachment=False, cache_control='no-cache', offload=None):
+    """
+    发送文件：强校验 ETag + Last-Modified (304)、单/多区间 206、零拷贝 sendfile
+    offload=(header, value) 时只做校验，由前端代理 (Caddy/Nginx 的 X-Accel-Redirect、X-Sendfile) 发送文件体
+    """
+    status, headers, ranges, size, content_type = evaluate(abs_path, request.headers, download_name, as_attachment, cache_control)
+    if status == 304: return Response(status=304, headers=headers)
+
+    if offload:
+        headers.pop('Content-Range', None); headers[offload[0]] = offload[1]
+        return Response(status=200, headers=headers, mimetype=content_type)
+
+    if status == 416: return Response(status=416, headers=headers)
+
+    if ranges is None:
+        resp = Response(_file_body(open(abs_path, 'rb'), 0, size), status=200, headers=headers, mimetype=content_type, direct_passthrough=True)
+        resp.content_length = size
+    elif len(ranges) == 1:
+        start, stop = ranges[0]
+        resp = Response(_file_body(open(abs_path, 'rb'), start, stop - start), status=206, headers=headers, mimetype=content_type, direct_passthrough=True)
+        resp.content_length = stop - start
+    else:
+        parts, trailer, boundary, length = multipart_parts(ranges, size, content_type)
+        resp = Response(_multipart_body(abs_path, parts, trailer), status=206, headers=headers,
+                        content_type=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True)
+        resp.content_length = length
+    return resp
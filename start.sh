@@ -1,7 +1,16 @@
 #!/bin/bash
 
-# 启动 Celery Worker (后台运行)
-celery -A tasks worker --loglevel=info &
+# 指标目录：gunicorn 各 worker 与 Celery 共用，/metrics 汇总；每次启动前清空旧数据
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# 启动 Celery Worker (后台运行)；-B 同时运行 beat，定期执行生命周期清理 (过期分享、打包结果、回收站)
+celery -A tasks worker -B -s /tmp/celerybeat-schedule --loglevel=info &
+
+# 可选：异步模式 (ASYNC_SERVING=1)，由 uvicorn 在 5001 端口处理 /s/ 与 /img/ 的文件下载 (需在 Caddyfile 中分流)
+if [ "$ASYNC_SERVING" = "1" ]; then
+    uvicorn asgi:application --host 0.0.0.0 --port 5001 --workers ${ASYNC_WORKERS:-2} &
+fi
 
 # 启动 Flask (使用 Gunicorn)
 # -w 4: 启动 4 个工作进程 (占用内存的主力)
@@ -1,12 +1,22 @@
 import os
 import time
-import zipfile
 from celery import Celery
+from celery.signals import task_prerun, task_postrun
+from archive import iter_members, write_zip
+from metrics import TASK_SECONDS, scan_timer
 
 # 从环境变量读取 Redis 配置，默认为 localhost (本地调试用)
 # 在 Docker Compose 中，REDIS_URL 会被设置为 redis://redis:6379/0
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
+# 压缩线程数，默认使用全部 CPU 核心
+ARCHIVE_WORKERS = int(os.getenv('ARCHIVE_WORKERS', '0')) or os.cpu_count() or 1
+
+# 没有 Redis 时 (本地调试) 可设 CELERY_EAGER=1，任务在提交请求内同步执行
+CELERY_EAGER = os.getenv('CELERY_EAGER', '0') == '1'
+JOB_RETRY_DELAY = 2 # 卷上并发已满时，文件任务隔多少秒重新排队
+LIFECYCLE_INTERVAL = int(os.getenv('LIFECYCLE_INTERVAL', '300')) # 生命周期清理周期 (秒)，由 beat 定时触发
+
 celery = Celery('tasks', broker=REDIS_URL, backend=REDIS_URL)
 
 celery.conf.update(
@@ -16,8 +26,24 @@ celery.conf.update(
     result_serializer='json',
     timezone='Asia/Shanghai',
     enable_utc=True,
+    task_always_eager=CELERY_EAGER,
+    beat_schedule={
+        'lifecycle': {'task': 'tasks.lifecycle_task', 'schedule': LIFECYCLE_INTERVAL, 'args': (LIFECYCLE_INTERVAL // 2,)},
+    },
 )
 
+# 任务耗时：prerun 记下开始时间，postrun 按任务名与最终状态写入直方图
+_task_started = {}
+
+@task_prerun.connect
+def _on_task_prerun(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+@task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    start = _task_started.pop(task_id, None)
+    if start is not None: TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - start)
+
 @celery.task(bind=True)
 def compress_files_task(self, file_paths):
     """
@@ -33,63 +59,85 @@ def compress_files_task(self, file_paths):
     zip_filename = f"archive_{int(time.time())}.zip"
     zip_filepath = os.path.join(base_dir, zip_filename)
 
-    total_files = 0
-    # 计算文件总数
-    for path in file_paths:
-        if os.path.isfile(path):
-            total_files += 1
-        elif os.path.isdir(path):
-            for _, _, filenames in os.walk(path):
-                total_files += len(filenames)
+    # 只遍历一次：先收集成员列表 (同时得到文件数和总字节数)，再交给并行压缩引擎
+    with scan_timer('archive_members'): members = list(iter_members(file_paths))
+    total_files = len(members)
+    total_bytes = sum(st.st_size for _, _, st in members)
 
-    processed_count = 0
+    def on_progress(files_done, bytes_done, name):
+        _update_progress(self, files_done, total_files, bytes_done, total_bytes, f"正在压缩: {os.path.basename(name)}")
 
+    from app import register_archive, unregister_archive
     try:
-        with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for path in file_paths:
-                if not os.path.exists(path):
-                    continue
-
-                if os.path.isfile(path):
-                    zf.write(path, arcname=os.path.basename(path))
-                    processed_count += 1
-                    _update_progress(self, processed_count, total_files, f"正在压缩: {os.path.basename(path)}")
-                    
-                elif os.path.isdir(path):
-                    parent_folder = os.path.dirname(path)
-                    for root, dirs, files in os.walk(path):
-                        for file in files:
-                            abs_path = os.path.join(root, file)
-                            rel_path = os.path.relpath(abs_path, parent_folder)
-                            zf.write(abs_path, arcname=rel_path)
-                            processed_count += 1
-                            _update_progress(self, processed_count, total_files, f"正在压缩: {file}")
-
+        register_archive(zip_filepath) # 先登记 (由本程序生成的标记)，再写入；到期后由 lifecycle_task 清理
+        write_zip(zip_filepath, members, workers=ARCHIVE_WORKERS, progress=on_progress)
+        register_archive(zip_filepath)
         return {
             'status': 'Completed',
             'result': zip_filepath,
             'filename': zip_filename,
-            'total_files': total_files
+            'total_files': total_files,
+            'total_bytes': total_bytes
         }
 
     except Exception as e:
+        try: os.remove(zip_filepath)
+        except OSError: pass
+        unregister_archive(zip_filepath)
         return {'status': 'Failed', 'error': str(e)}
 
 
-def _update_progress(task_instance, current, total, status_msg):
-    if total == 0:
-        percent = 0
+@celery.task(bind=True)
+def file_job_task(self, job_id):
+    """
+    移动/复制/删除/还原/清空回收站：具体操作与元数据更新在 app.execute_job 中
+    这里只负责按卷限流：名额已满时重新排队 (不占用 worker)，轮到后执行；进度与结果写入 JobManager
+    """
+    from app import job_manager, execute_job # 延迟导入：worker 只在执行文件任务时才加载应用
+    while True:
+        state = job_manager.acquire(job_id)
+        if state != 'wait': break
+        if not self.request.is_eager: raise self.retry(countdown=JOB_RETRY_DELAY, max_retries=None)
+        time.sleep(JOB_RETRY_DELAY)
+    if state == 'run': execute_job(job_id)
+    job = job_manager.get(job_id)
+    return {'status': job['state'] if job else state}
+
+
+@celery.task(bind=True)
+def hls_task(self, rel_path):
+    """视频转 HLS (转封装 + 多码率转码)，进度写在 HLS 缓存的构建标记中，由 /api/hls 查询"""
+    from app import hls_cache, ROOT_DIR
+    abs_path = os.path.join(ROOT_DIR, rel_path)
+    try: hls_cache.build(abs_path, rel_path, self.request.id)
+    except Exception as e: return {'status': 'Failed', 'error': str(e)}
+    finally: hls_cache.evict()
+    return {'status': 'Completed', 'path': rel_path}
+
+
+@celery.task
+def lifecycle_task(interval=0):
+    """清理到期的分享链接、打包结果与回收站条目，并在磁盘使用率超过高水位时提前淘汰 (beat 每 LIFECYCLE_INTERVAL 秒触发)"""
+    from app import run_lifecycle
+    counts = run_lifecycle(interval)
+    return {'status': 'Skipped'} if counts is None else {'status': 'Completed', **counts}
+
+
+def _update_progress(task_instance, current, total, bytes_done, bytes_total, status_msg):
+    # 进度按字节计算 (大文件不再卡在同一个百分比)，更新频率由压缩引擎限制，避免 Redis 压力过大
+    if bytes_total:
+        percent = int((bytes_done / bytes_total) * 100)
     else:
-        percent = int((current / total) * 100)
-
-    # 稍微限制一下更新频率，防止 Redis 压力过大
-    if current % 5 == 0 or current == total:
-        task_instance.update_state(
-            state='PROGRESS',
-            meta={
-                'current': current,
-                'total': total,
-                'percent': percent,
-                'status': status_msg
-            }
-        )
+        percent = int((current / total) * 100) if total else 0
+
+    task_instance.update_state(
+        state='PROGRESS',
+        meta={
+            'current': current,
+            'total': total,
+            'bytes_done': bytes_done,
+            'bytes_total': bytes_total,
+            'percent': percent,
+            'status': status_msg
+        }
+    )
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+import jobs
+
+
+class Progress:
+    def advance(self, nbytes=0, current=None): pass
+    def heartbeat(self): pass
+
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, 'a', 'sub'))
+    with open(os.path.join(root, 'a', 'f.txt'), 'w') as f: f.write('hi')
+    with open(os.path.join(root, 'a', 'sub', 'g.txt'), 'w') as f: f.write('there')
+
+
+def test_copy_tree_into_itself_is_rejected(tmp_path):
+    make_tree(tmp_path)
+    src = os.path.join(tmp_path, 'a')
+    with pytest.raises(ValueError):
+        jobs.copy_tree(src, os.path.join(src, 'a'), Progress())
+    with pytest.raises(ValueError):
+        jobs.copy_tree(src, os.path.join(src, 'sub', 'a'), Progress())
+    assert sorted(os.listdir(src)) == ['f.txt', 'sub']
+    assert os.listdir(os.path.join(src, 'sub')) == ['g.txt']
+
+
+def test_move_path_into_itself_is_rejected(tmp_path):
+    make_tree(tmp_path)
+    src = os.path.join(tmp_path, 'a')
+    with pytest.raises(ValueError):
+        jobs.move_path(src, os.path.join(src, 'sub', 'a'), Progress())
+    assert sorted(os.listdir(src)) == ['f.txt', 'sub']
+
+
+def test_copy_tree_to_sibling_with_common_prefix(tmp_path):
+    make_tree(tmp_path)
+    jobs.copy_tree(os.path.join(tmp_path, 'a'), os.path.join(tmp_path, 'ab'), Progress())
+    assert sorted(os.listdir(os.path.join(tmp_path, 'ab'))) == ['f.txt', 'sub']
+
+
+def test_copy_tree_skips_suffixes(tmp_path):
+    make_tree(tmp_path)
+    with open(os.path.join(tmp_path, 'a', '.up.f.part'), 'w') as f: f.write('x')
+    jobs.copy_tree(os.path.join(tmp_path, 'a'), os.path.join(tmp_path, 'b'), Progress(), skip_suffixes=('.part',))
+    assert sorted(os.listdir(os.path.join(tmp_path, 'b'))) == ['f.txt', 'sub']
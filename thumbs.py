@@ -0,0 +1,94 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from metrics import scan_timer
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow 未安装时缩略图功能自动关闭，前端回退到原图
+    Image = None
+
+THUMB_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.ico'}
+THUMB_SIZES = (128, 256, 512)
+THUMB_SUFFIX = '.webp'
+TOUCH_INTERVAL = 3600 # 命中后最多每小时刷新一次 mtime，作为 LRU 淘汰依据
+EVICT_EVERY = 100 # 每生成多少张检查一次缓存总量
+
+
+def render_thumbnail(src, dest, size):
+    """在子进程中执行：生成 WebP 缩略图，先写临时文件再原子替换"""
+    with Image.open(src) as img:
+        img.draft('RGB', (size, size)) # JPEG 可直接按缩小比例解码，速度快很多
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'): img = img.convert('RGBA' if img.mode == 'LA' or 'transparency' in img.info else 'RGB')
+        img.thumbnail((size, size))
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        img.save(tmp, 'WEBP', quality=80, method=4)
+    os.replace(tmp, dest)
+    return dest
+
+
+class ThumbnailCache:
+    """
+    缩略图磁盘缓存：文件名为 sha1(相对路径 + mtime + 大小 + 尺寸)，原图一改动自然失效
+    生成在本地进程池中进行；缓存总量超过 max_bytes 时按 mtime 淘汰最久未访问的
+    """
+    def __init__(self, cache_dir, max_bytes, workers=2):
+        self.cache_dir, self.max_bytes, self.workers = cache_dir, max_bytes, workers
+        self._pool, self._pid, self._lock = None, None, threading.Lock()
+        self._generated = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def available(self):
+        return Image is not None
+
+    @staticmethod
+    def supports(name):
+        return os.path.splitext(name)[1].lower() in THUMB_EXTENSIONS
+
+    def cached_path(self, rel_path, mtime, file_size, size):
+        # mtime 取毫秒整数：目录遍历得到的 stat 与文件索引中保存的 mtime 算出同一个键
+        key = hashlib.sha1(f"{rel_path}\0{int(mtime * 1000)}\0{file_size}\0{size}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + THUMB_SUFFIX)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid(): # fork 之后重新创建进程池
+                self._pool, self._pid = ProcessPoolExecutor(self.workers), os.getpid()
+            return self._pool
+
+    def get(self, abs_path, rel_path, size):
+        """返回缩略图路径 (必要时生成)；不支持的格式返回 None"""
+        if not self.available or not self.supports(rel_path): return None
+        st = os.stat(abs_path)
+        dest = self.cached_path(rel_path, st.st_mtime, st.st_size, size)
+        try:
+            if time.time() - os.stat(dest).st_mtime > TOUCH_INTERVAL: os.utime(dest)
+            return dest
+        except FileNotFoundError: pass
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        self._executor().submit(render_thumbnail, abs_path, dest, size).result()
+        with self._lock:
+            self._generated += 1
+            evict = self._generated % EVICT_EVERY == 1
+        if evict: threading.Thread(target=self.evict, daemon=True).start()
+        return dest
+
+    def evict(self):
+        entries, total = [], 0
+        with scan_timer('thumb_evict'):
+            for root, dirs, files in os.walk(self.cache_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try: st = os.stat(path)
+                    except OSError: continue
+                    entries.append((st.st_mtime, st.st_size, path)); total += st.st_size
+        if total <= self.max_bytes: return
+        target = self.max_bytes * 0.9
+        for mtime, size, path in sorted(entries):
+            try: os.remove(path); total -= size
+            except OSError: pass
+            if total <= target: break